@@ -0,0 +1,369 @@
+"""
+    性能回归测试
+    在回环地址上按固定的场景（丢包率、窗口大小、文件大小等）运行 gbn_main 的发送方和接收方，
+    丢包使用固定的随机数种子，文件内容也由种子生成，因此每次运行的丢包位置和发送的数据都相同。
+    另有两个只消耗 CPU 的场景，直接反复调用热路径：codec 为数据包的编码和解码，window 为接收方处理按序到达的数据包
+    以及发送方根据 ACK 滑动窗口。
+    吞吐量和 CPU 时间与机器有关，而且同一台机器的速度也会随时间变化，因此每次运行场景的前后都测量一个
+    不依赖本项目代码的校准负载（marshal 编解码加上回环地址上的 sendto 和 recvfrom），指标都以它为单位。
+    其他进程的干扰只会使结果变差，因此场景和校准负载都取多次运行中各自最好的一次，再计算两者之比：
+    goodput_ratio    有效吞吐量与校准负载的吞吐量之比
+    cpu_ratio        每传输 1 MB 数据消耗的 CPU 时间（包括所有线程）与校准负载的之比
+    peak_alloc       传输期间 tracemalloc 统计的内存分配峰值（字节）
+    syscalls_per_mb  每传输 1 MB 数据调用 sendto、recvfrom 和 fsync 的次数
+    后两个指标单独运行一次统计，以免计数和 tracemalloc 的开销影响前两个指标。
+    各指标与 benchmark_baseline.json 中的基线比较，退化超过允许的幅度即视为失败。
+    使用方法：
+    python benchmark.py [场景...]           运行场景并与基线比较，有指标退化时退出码为 1
+    python benchmark.py --update [场景...]  运行场景并把结果写入基线文件
+    GBN_BENCHMARK=1 python -m pytest       在 pytest 中运行，每个场景是一个测试用例，没有设置该环境变量时跳过
+"""
+import argparse
+import json
+import marshal
+import os
+import random
+import statistics
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from threading import Event
+
+import gbn_main
+import profiler
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# 丢包和文件内容使用的随机数种子
+SEED = 4567
+# 统计吞吐量和 CPU 时间时每个场景的运行次数，取其中最好的一次以减少其他进程的干扰。
+# 运行次数越多最好的一次越好，因此基线与比较需要使用相同的次数。
+# 更新基线时按相同的次数测量 UPDATE_ROUNDS 轮，每个指标取各轮的中位数，以免把一轮偶然偏好或偏差的结果当作基准
+UPDATE_ROUNDS = 3
+REPEAT = 5
+MB = 1 << 20
+# 校准负载和 CPU 场景中每个数据包携带的字节数
+PAYLOAD = 500
+# 校准负载处理的数据量，运行时间需要远大于计时的精度
+CALIBRATION = 8 * MB
+
+# 场景名 -> 参数：size 为文件大小，data 为文件内容（random 为随机字节，text 为可压缩的文本），
+# 其余参数对应 gbn_main 中的同名设置，没有给出的参数使用 gbn_main 的默认值。
+# micro 为只消耗 CPU 的场景，size 为它处理的数据量。
+# tolerance 为该场景单独放宽的允许幅度：有丢包时重传的次数取决于超时和 ACK 到达的先后，吞吐量和 CPU 时间的波动更大
+SCENARIOS = {
+    'clean': {'size': 4 * MB, 'data': 'random', 'window': 5, 'loss': 0.0},
+    'wide': {'size': 4 * MB, 'data': 'random', 'window': 32, 'loss': 0.0},
+    'lossy': {'size': 4 * MB, 'data': 'random', 'window': 8, 'loss': 0.05, 'timeout': 0.1,
+              'tolerance': {'goodput_ratio': 0.5, 'cpu_ratio': 0.5}},
+    'fec': {'size': 4 * MB, 'data': 'random', 'window': 8, 'loss': 0.05, 'timeout': 0.1, 'fec': (4, 1),
+            'tolerance': {'goodput_ratio': 0.5, 'cpu_ratio': 0.5}},
+    'compress': {'size': 4 * MB, 'data': 'text', 'window': 5, 'loss': 0.0, 'compress': ('zlib', 6)},
+    'codec': {'size': 32 * MB, 'micro': 'codec'},
+    'window': {'size': 16 * MB, 'micro': 'window'},
+}
+
+# 指标 -> (是否越大越好, 默认允许的相对退化幅度)，基线文件中的 tolerance 可以覆盖默认值，场景的 tolerance 又可以覆盖基线文件中的值。
+# 系统调用次数和内存峰值几乎不变，吞吐量和 CPU 时间经过校准并取最好的一次之后，波动一般在 25% 以内，
+# 而热路径慢一倍时 cpu_ratio 会增加 60% 以上
+METRICS = {
+    'goodput_ratio': (True, 0.35),
+    'cpu_ratio': (False, 0.35),
+    'peak_alloc': (False, 0.1),
+    'syscalls_per_mb': (False, 0.05),
+}
+
+# 计为系统调用的函数
+SYSCALLS = (
+    ('socket.sendto', socket.socket, 'sendto'),
+    ('socket.recvfrom', socket.socket, 'recvfrom'),
+    ('os.fsync', os, 'fsync'),
+)
+
+
+def calibrate() -> tuple:
+    """
+        运行一次校准负载：CALIBRATION 字节的数据按 PAYLOAD 字节一个数据包，经过 marshal 编解码后在回环地址上
+        发给自己再收回来。返回 (吞吐量, 每 MB 的 CPU 时间)
+    """
+    payload = bytes(PAYLOAD)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((gbn_main.IP, 0))
+        addr = sock.getsockname()
+        wall, cpu = time.perf_counter(), time.process_time()
+        for seq in range(CALIBRATION // PAYLOAD):
+            sock.sendto(marshal.dumps({'ack': 0, 'seq': seq, 'data': payload, 'flag': 0}), addr)
+            marshal.loads(sock.recvfrom(gbn_main.BUFFER_SIZE)[0])
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return CALIBRATION / wall, cpu / (CALIBRATION / MB)
+
+
+def best_of(repeat: int, run) -> tuple:
+    """
+        交替运行 repeat + 1 次校准负载和 repeat 次 run，返回 (各次 run 的返回值, 校准负载最好的吞吐量, 最好的每 MB 的 CPU 时间)。
+        其他进程的干扰只会使结果变差，因此场景和校准负载都取各自最好的一次，两者之比受干扰的影响最小
+    """
+    results = []
+    calibrations = [calibrate()]
+    for _ in range(repeat):
+        results.append(run())
+        calibrations.append(calibrate())
+    return results, max(goodput for goodput, _ in calibrations), min(cpu for _, cpu in calibrations)
+
+
+def make_source(scenario: dict, path: str):
+    """
+        按场景生成待发送的文件，相同的场景总是生成相同的内容
+    """
+    rand = random.Random(SEED)
+    if scenario['data'] == 'text':
+        words = [''.join(rand.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rand.randint(2, 9)))
+                 for _ in range(512)]
+        parts = []
+        length = 0
+        while length < scenario['size']:
+            line = ' '.join(rand.choice(words) for _ in range(rand.randint(4, 14))) + '\n'
+            parts.append(line)
+            length += len(line)
+        data = ''.join(parts).encode()[:scenario['size']]
+    else:
+        data = rand.randbytes(scenario['size'])
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+def free_port() -> int:
+    """
+        每次运行使用一个新的端口，避免收到上一次运行残留的报文
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((gbn_main.IP, 0))
+        return sock.getsockname()[1]
+
+
+def configure(scenario: dict) -> dict:
+    """
+        按场景修改 gbn_main 的设置，返回原来的设置以便之后恢复
+    """
+    values = {'VERBOSE': False}
+    for key, name in (('window', 'WINDOW_SIZE'), ('loss', 'LOST_POSSIBILITY'), ('mss', 'MSS'),
+                      ('timeout', 'TIMEOUT'), ('fec', 'FEC'), ('compress', 'COMPRESS')):
+        if key in scenario:
+            values[name] = scenario[key]
+    saved = {name: getattr(gbn_main, name) for name in values}
+    for name, value in values.items():
+        setattr(gbn_main, name, value)
+    return saved
+
+
+def transfer(src: str, out: str) -> tuple:
+    """
+        在回环地址上把 src 传输到 out，丢包从固定的种子开始。返回 (是否成功, 耗时, CPU 时间)，
+        只统计发送方从建立连接到收到 FIN-ACK 的这段时间，不包括接收方随后的逗留时间
+    """
+    random.seed(SEED)
+    addr = (gbn_main.IP, free_port())
+    event = Event()
+    waiter = gbn_main.stripe_receive(out, 1, event, addr)
+    clients = []
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        clients = gbn_main.stripe_send(src, 1, addr)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    finally:
+        # 发送方失败时接收方不会收到 FIN，需要主动让它退出
+        if not clients or not all(client_ins.completed for client_ins in clients):
+            event.set()
+        waiter.join()
+    return all(client_ins.completed for client_ins in clients), wall, cpu
+
+
+def check(name: str, ok: bool, src: str, out: str):
+    with open(src, 'rb') as a, open(out, 'rb') as b:
+        if not ok or a.read() != b.read():
+            raise RuntimeError(name + ' 场景的传输失败或输出文件与源文件不一致')
+
+
+def run_codec(size: int):
+    """
+        把 size 字节的数据按 PAYLOAD 字节一个数据包编码后再解码
+    """
+    payload = bytes(PAYLOAD)
+    for seq in range(size // PAYLOAD):
+        gbn_main.packet.decode(gbn_main.packet(0, seq, payload, gbn_main.DATA).encode())
+
+
+def run_window(size: int):
+    """
+        接收方依次处理 size 字节的按序到达的数据包并回复 ACK，发送方根据这些 ACK 滑动窗口。
+        接收方的 ACK 发往一个不读取数据的套接字，缓冲区满后由内核直接丢弃
+    """
+    count = size // PAYLOAD
+    payload = bytes(PAYLOAD)
+    event = Event()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sink:
+        sink.bind((gbn_main.IP, 0))
+        server_ins = gbn_main.server((gbn_main.IP, 0), event)
+        client_ins = gbn_main.client(sink.getsockname(), event)
+        try:
+            server_ins.client = sink.getsockname()
+            client_ins.max = count
+            for seq in range(count):
+                server_ins.receive_data(gbn_main.packet(0, seq, payload, gbn_main.DATA))
+                client_ins.slide(gbn_main.packet(seq + 1, 0, '', gbn_main.ACK))
+        finally:
+            server_ins.sock.close()
+            client_ins.sock.close()
+    if client_ins.s_beg != count:
+        raise RuntimeError('window 场景中发送方的窗口没有滑动到终点')
+
+
+MICRO = {'codec': run_codec, 'window': run_window}
+
+
+def process_time(run, size: int) -> float:
+    cpu = time.process_time()
+    run(size)
+    return time.process_time() - cpu
+
+
+def measure_micro(scenario: dict, repeat: int) -> dict:
+    run = MICRO[scenario['micro']]
+    mb = scenario['size'] / MB
+    cpus, _, reference = best_of(repeat, lambda: process_time(run, scenario['size']))
+    return {'cpu_ratio': round(min(cpus) / mb / reference, 4)}
+
+
+def measure_transfer(name: str, scenario: dict, repeat: int) -> dict:
+    mb = scenario['size'] / MB
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, name + '.bin')
+        make_source(scenario, src)
+        out = os.path.join(tmp, 'out')
+
+        def run() -> tuple:
+            ok, wall, cpu = transfer(src, out)
+            check(name, ok, src, out)
+            os.remove(out)
+            return wall, cpu
+
+        timings, reference_goodput, reference_cpu = best_of(repeat, run)
+        prof = profiler.Profiler()
+        for stage, owner, attr in SYSCALLS:
+            prof.instrument(owner, attr, stage)
+        tracemalloc.start()
+        try:
+            ok = transfer(src, out)[0]
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            prof.restore()
+        check(name, ok, src, out)
+    return {
+        'goodput_ratio': round(scenario['size'] / min(wall for wall, _ in timings) / reference_goodput, 4),
+        'cpu_ratio': round(min(cpu for _, cpu in timings) / mb / reference_cpu, 4),
+        'peak_alloc': peak,
+        'syscalls_per_mb': round(sum(hist.count for hist in prof.stages.values()) / mb, 1),
+    }
+
+
+def measure(name: str, repeat: int = REPEAT) -> dict:
+    """
+        运行一个场景，返回它的各项指标
+    """
+    scenario = SCENARIOS[name]
+    saved = configure(scenario)
+    try:
+        if 'micro' in scenario:
+            return measure_micro(scenario, repeat)
+        return measure_transfer(name, scenario, repeat)
+    finally:
+        for attr, value in saved.items():
+            setattr(gbn_main, attr, value)
+
+
+def load_baseline(path: str = BASELINE) -> dict:
+    if not os.path.isfile(path):
+        return {'tolerance': {}, 'scenarios': {}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_baseline(baseline: dict, path: str = BASELINE):
+    with open(path, 'w') as file:
+        json.dump(baseline, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def compare(name: str, result: dict, baseline: dict) -> list:
+    """
+        把一个场景的指标与基线比较，返回退化超过允许幅度的指标的说明，场景没有基线时返回空列表
+    """
+    expected = baseline['scenarios'].get(name, {})
+    regressions = []
+    for metric, value in result.items():
+        if metric not in expected:
+            continue
+        higher, tolerance = METRICS[metric]
+        tolerance = baseline['tolerance'].get(metric, tolerance)
+        tolerance = SCENARIOS[name].get('tolerance', {}).get(metric, tolerance)
+        limit = expected[metric] * (1 - tolerance if higher else 1 + tolerance)
+        if value < limit if higher else value > limit:
+            regressions.append('%s.%s 为 %s，基线为 %s，不能%s %s' % (
+                name, metric, value, expected[metric], '低于' if higher else '高于', round(limit, 4)))
+    return regressions
+
+
+def change(value: float, expected) -> str:
+    if not expected:
+        return '-'
+    return '%+.1f%%' % ((value - expected) / expected * 100)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='benchmark.py', description='GBN 协议模拟器的性能回归测试')
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO',
+                        help='要运行的场景，默认运行全部场景：' + '、'.join(SCENARIOS))
+    parser.add_argument('--update', action='store_true', help='把本次的结果写入基线文件，不做比较')
+    parser.add_argument('--repeat', type=gbn_main.positive_int, default=REPEAT,
+                        help='统计吞吐量和 CPU 时间时的运行次数，更新基线时应与比较时相同')
+    parser.add_argument('--baseline', default=BASELINE, help='基线文件')
+    parser.add_argument('--json', action='store_true', help='以 JSON 格式输出结果')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error('未知的场景：' + '、'.join(unknown))
+    baseline = load_baseline(args.baseline)
+    results = {}
+    regressions = []
+    for name in args.scenarios or SCENARIOS:
+        if args.update:
+            rounds = [measure(name, args.repeat) for _ in range(UPDATE_ROUNDS)]
+            results[name] = {metric: statistics.median(result[metric] for result in rounds) for metric in rounds[0]}
+        else:
+            results[name] = measure(name, args.repeat)
+            regressions.extend(compare(name, results[name], baseline))
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print('%-10s %-16s %14s %14s %9s' % ('scenario', 'metric', 'value', 'baseline', 'change'))
+        for name, result in results.items():
+            expected = baseline['scenarios'].get(name, {})
+            for metric, value in result.items():
+                print('%-10s %-16s %14s %14s %9s' % (name, metric, value, expected.get(metric, '-'),
+                                                     change(value, expected.get(metric))))
+    if args.update:
+        baseline['scenarios'].update(results)
+        baseline['tolerance'] = {metric: baseline['tolerance'].get(metric, tolerance)
+                                 for metric, (_, tolerance) in METRICS.items()}
+        save_baseline(baseline, args.baseline)
+        print('基线已写入 ' + args.baseline, file=sys.stderr)
+        return 0
+    for line in regressions:
+        print(line, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+    数据压缩模块
+    发送方把尽量长的一段原始数据压缩成一个数据段，只要压缩结果不超过 mss 即可，
+    因此压缩效果越好，每个数据段携带的原始数据越多，需要发送的数据段也就越少。
+    最近若干个数据段的压缩率不理想时自动跳过压缩，直接发送原始数据，过一段时间后再重新尝试。
+    默认使用 zlib，其他更快的编码只需要实现相同签名的 compress 和 decompress，并注册到 CODECS 中即可，
+    decompress 的 limit 为解压结果的上限，超过时需要抛出 ValueError，以免恶意的数据段耗尽接收方的内存。
+"""
+import zlib
+
+# 压缩后与压缩前的长度之比的滑动平均超过该值时，认为数据难以压缩
+BYPASS_RATIO = 0.9
+# 跳过压缩的数据段个数，之后重新尝试压缩
+BYPASS_BLOCKS = 32
+# 滑动平均中最新一个数据段所占的权重
+SMOOTHING = 0.25
+# 一个数据段解压后最多为 mss 的多少倍，限制接收方解压后的数据大小
+MAX_RATIO = 64
+# 查找数据段长度时的精度为 mss 的 1/PRECISION，但不小于 GRANULE 字节；
+# 压缩结果已经超过 mss 的 1 - 1/PRECISION 时也不再继续查找
+GRANULE = 32
+PRECISION = 16
+# 查找一个数据段的长度时最多压缩的次数，用完时使用已经找到的最长的结果
+FIT_ATTEMPTS = 6
+
+
+def zlib_compress(data: bytes, level: int) -> bytes:
+    return zlib.compress(data, level)
+
+
+def zlib_decompress(data: bytes, limit: int) -> bytes:
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(data, limit)
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError('数据段不完整，或者解压后超过 ' + str(limit) + ' 字节')
+    return result
+
+
+CODECS = {
+    'zlib': (zlib_compress, zlib_decompress),
+}
+
+
+def decompress(data: bytes, mss: int, codec: str = 'zlib') -> bytes:
+    """
+        解压一个数据段，结果最多为 mss * MAX_RATIO 字节，数据段损坏或者解压后超过该长度时抛出 ValueError
+    """
+    try:
+        return CODECS[codec][1](data, mss * MAX_RATIO)
+    except zlib.error as e:
+        raise ValueError(str(e))
+
+
+class Compressor:
+    """
+        发送方的压缩阶段，记录最近的压缩率，以决定是否跳过压缩
+    """
+
+    def __init__(self, mss: int, codec: str = 'zlib', level: int = 6) -> None:
+        self.mss = mss
+        self.codec = codec
+        self.level = level
+        # 最近的压缩率的滑动平均，为 None 时以下一个数据段的压缩率为准
+        self.ratio = None
+        self.skip = 0
+
+    def pack(self, read, beg: int, end: int):
+        """
+            把原始数据的 [beg, end) 区间依次打包成数据段，read(off, size) 用于读取原始数据。
+            逐个生成 (off, size, payload)：payload 为 [off, off + size) 压缩后的结果，为 None 时表示直接发送原始数据
+        """
+        off = beg
+        while off < end:
+            if self.skip > 0:
+                self.skip -= 1
+                size = min(self.mss, end - off)
+                yield off, size, None
+                off += size
+                continue
+            size, payload = self.fit(read, off, min(end, off + self.mss * MAX_RATIO))
+            self.observe(len(payload) / size if payload is not None else 1.0)
+            if payload is None or len(payload) >= size:
+                # 压缩后仍然超过 mss 或者没有变短，只能发送原始数据
+                size = min(self.mss, end - off)
+                yield off, size, None
+            else:
+                yield off, size, payload
+            off += size
+
+    def fit(self, read, off: int, end: int) -> tuple:
+        """
+            找出压缩后不超过 mss 的尽量长的 [off, off + size)，返回 (size, payload)，
+            mss 字节的数据压缩后就超过 mss 时 payload 为 None。
+            压缩后的长度大致与原始数据的长度成正比：第一次按滑动平均的压缩率估计长度，之后按上一次的压缩结果
+            修正估计，直到压缩结果接近 mss 或者上下界之差不超过精度为止。估计时略微偏小，使得第一次的结果通常就能用上。
+            原始数据只在需要时才读取，不会一次读入 end - off 字节
+        """
+        compress = CODECS[self.codec][0]
+        granule = max(GRANULE, self.mss // PRECISION)
+        # 压缩结果达到 full 字节即可使用，估计长度时以它为目标
+        full = self.mss - self.mss // PRECISION
+        floor = min(self.mss, end - off)
+        data = b''
+        best = (0, None)
+        low, high = 0, end - off + 1
+        size = floor if self.ratio is None else int(full / self.ratio)
+        for _ in range(FIT_ATTEMPTS):
+            size = max(floor, min(size, end - off))
+            if len(data) < size:
+                data += read(off + len(data), size - len(data))
+            payload = compress(data[:size], self.level)
+            if len(payload) > self.mss:
+                high = size
+                if size == floor:
+                    break
+            else:
+                best = (size, payload)
+                low = size
+                if len(payload) >= full:
+                    break
+            if high - low <= granule:
+                break
+            size = min(max(size * full // max(len(payload), 1), low + granule), high - granule)
+        return best
+
+    def observe(self, ratio: float):
+        self.ratio = ratio if self.ratio is None else self.ratio + SMOOTHING * (ratio - self.ratio)
+        if self.ratio > BYPASS_RATIO:
+            self.skip = BYPASS_BLOCKS
+            self.ratio = None
@@ -9,23 +9,38 @@ IP = '127.0.0.1'
 PORT = 4567
 WINDOW_SIZE = 4
 TIMEOUT = 2
+# 每一方总共发送的数据包个数
+TOTAL = 20
+# 握手与挥手阶段等待应答的时间和最大重试次数
+HANDSHAKE_TIMEOUT = 0.2
+HANDSHAKE_RETRY = 5
+# 双方都完成挥手后的逗留时间，需要大于 HANDSHAKE_TIMEOUT
+LINGER = 0.5
+
+# 报文首部的标志位，SYN | ACK 即为 SYN-ACK 报文
+DATA = 0
+SYN = 1
+ACK = 2
+FIN = 4
 
 @dataclass
 class Packet:
     ack: int
     seq: int
     data: str
+    flag: int = DATA
 
     def to_dict(self):
         return {
             'ack': self.ack,
             'seq': self.seq,
-            'data': self.data
+            'data': self.data,
+            'flag': self.flag
         }
 
     @staticmethod
     def from_dict(dict: dict):
-        return Packet(dict['ack'], dict['seq'], dict['data'])
+        return Packet(dict['ack'], dict['seq'], dict['data'], dict.get('flag', DATA))
 
 
 class Server:
@@ -39,6 +54,10 @@ class Server:
         self.packets = []
         self.ack_received = [False] * 100
         self.event = Event()
+        self.client_addr = None
+        # 本方的 FIN 已被确认、对方的 FIN 已经收到，两者都满足时连接才真正关闭
+        self.fin_acked = Event()
+        self.peer_finished = Event()
 
     def send_packet(self, packet, client_addr):
         if random.random() > 0.1:  # 模拟丢包，90%的概率发送成功
@@ -47,52 +66,89 @@ class Server:
         else:
             print(f"丢失: {packet}")
 
+    def send_control(self, flag, data=''):
+        packet = Packet(ack=0, seq=self.nextseqnum, data=data, flag=flag)
+        self.sock.sendto(marshal.dumps(packet.to_dict()), self.client_addr)
+
+    def accept(self):
+        while True:
+            try:
+                buf, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            packet = Packet.from_dict(marshal.loads(buf))
+            if packet.flag & SYN:
+                self.client_addr = addr
+                self.send_control(SYN | ACK, {'window': WINDOW_SIZE})
+                print(f"与客户端 {addr} 建立连接")
+                return
+
+    def close(self):
+        for _ in range(HANDSHAKE_RETRY):
+            self.send_control(FIN)
+            print("服务器发送FIN")
+            if self.fin_acked.wait(HANDSHAKE_TIMEOUT):
+                return
+        print("未收到FIN-ACK，强制关闭连接")
+        self.fin_acked.set()
+
     def server_start(self):
-        Thread(target=self.receive_ack).start()
-        Thread(target=self.receive_packet).start()  # 增加接收数据的线程
-        client_addr = None
+        self.accept()
+        Thread(target=self.receive).start()
+        client_addr = self.client_addr
         while True:
-            while self.nextseqnum < self.base + WINDOW_SIZE:
+            while self.nextseqnum < min(self.base + WINDOW_SIZE, TOTAL):
                 data = f"消息 {self.nextseqnum}"
                 packet = Packet(ack=0, seq=self.nextseqnum, data=data)
                 self.packets.append(packet)
-                client_addr = (IP, PORT)
                 self.send_packet(packet, client_addr)
                 self.nextseqnum += 1
                 time.sleep(1)
             self.event.wait(TIMEOUT)
-            if self.base == self.nextseqnum:
+            if self.base == TOTAL:
                 break
             self.event.clear()
+        self.close()
 
-    def receive_ack(self):
-        while True:
+    def receive(self):
+        # ACK 和数据包共用一个套接字，由同一个线程按标志位分发，避免两个线程互相抢走对方的报文
+        while not (self.fin_acked.is_set() and self.peer_finished.is_set()):
             try:
                 buf, _ = self.sock.recvfrom(1024)
-                ack_packet = Packet.from_dict(marshal.loads(buf))
-                print(f"收到ACK: {ack_packet}")
-                self.ack_received[ack_packet.ack] = True
-                if ack_packet.ack == self.base:
-                    while self.ack_received[self.base]:
-                        self.base += 1
-                    self.event.set()
             except socket.timeout:
                 for i in range(self.base, self.nextseqnum):
-                    self.send_packet(self.packets[i], (IP, PORT))
-
-    def receive_packet(self):
-        while True:
-            try:
-                buf, _ = self.sock.recvfrom(1024)
-                packet = Packet.from_dict(marshal.loads(buf))
-                print(f"从客户端收到: {packet}")
-                self.send_ack(packet.seq)
-            except socket.timeout:
+                    self.send_packet(self.packets[i], self.client_addr)
                 continue
+            packet = Packet.from_dict(marshal.loads(buf))
+            if packet.flag == FIN | ACK:
+                self.fin_acked.set()
+            elif packet.flag & FIN:
+                self.send_control(FIN | ACK)
+                self.peer_finished.set()
+            elif packet.flag & SYN:
+                self.send_control(SYN | ACK, {'window': WINDOW_SIZE})
+            elif packet.flag & ACK:
+                self.receive_ack(packet)
+            else:
+                self.receive_packet(packet)
+        linger(self.sock, self.send_control)
+        print("服务器连接已关闭")
+
+    def receive_ack(self, ack_packet):
+        print(f"收到ACK: {ack_packet}")
+        self.ack_received[ack_packet.ack] = True
+        if ack_packet.ack == self.base:
+            while self.ack_received[self.base]:
+                self.base += 1
+            self.event.set()
+
+    def receive_packet(self, packet):
+        print(f"从客户端收到: {packet}")
+        self.send_ack(packet.seq)
 
     def send_ack(self, ack):
-        ack_packet = Packet(ack=ack, seq=0, data='')
-        self.sock.sendto(marshal.dumps(ack_packet.to_dict()), (IP, PORT))
+        ack_packet = Packet(ack=ack, seq=0, data='', flag=ACK)
+        self.sock.sendto(marshal.dumps(ack_packet.to_dict()), self.client_addr)
         print(f"发送ACK: {ack_packet}")
 
 
@@ -107,8 +163,9 @@ class Client:
         self.packets = []
         self.ack_received = [False] * 100
         self.event = Event()
-        Thread(target=self.receive_packet).start()
-        Thread(target=self.receive_ack).start()
+        self.expected_seq = 0
+        self.fin_acked = Event()
+        self.peer_finished = Event()
 
     def send_packet(self, packet):
         if random.random() > 0.1:  # 模拟丢包，90%的概率发送成功
@@ -117,9 +174,42 @@ class Client:
         else:
             print(f"丢失: {packet}")
 
+    def send_control(self, flag, data=''):
+        packet = Packet(ack=0, seq=self.nextseqnum, data=data, flag=flag)
+        self.sock.sendto(marshal.dumps(packet.to_dict()), self.server)
+
+    def connect(self):
+        self.sock.settimeout(HANDSHAKE_TIMEOUT)
+        try:
+            for _ in range(HANDSHAKE_RETRY):
+                self.send_control(SYN)
+                try:
+                    buf, _ = self.sock.recvfrom(1024)
+                except socket.timeout:
+                    continue
+                if Packet.from_dict(marshal.loads(buf)).flag == SYN | ACK:
+                    print("与服务器建立连接")
+                    return True
+            return False
+        finally:
+            self.sock.settimeout(TIMEOUT)
+
+    def close(self):
+        for _ in range(HANDSHAKE_RETRY):
+            self.send_control(FIN)
+            print("客户端发送FIN")
+            if self.fin_acked.wait(HANDSHAKE_TIMEOUT):
+                return
+        print("未收到FIN-ACK，强制关闭连接")
+        self.fin_acked.set()
+
     def client_start(self):
+        if not self.connect():
+            print("无法与服务器建立连接")
+            return
+        Thread(target=self.receive).start()
         while True:
-            while self.nextseqnum < self.base + WINDOW_SIZE:
+            while self.nextseqnum < min(self.base + WINDOW_SIZE, TOTAL):
                 data = f"消息 {self.nextseqnum}"
                 packet = Packet(ack=0, seq=self.nextseqnum, data=data)
                 self.packets.append(packet)
@@ -127,46 +217,68 @@ class Client:
                 self.nextseqnum += 1
                 time.sleep(1)
             self.event.wait(TIMEOUT)
-            if self.base == self.nextseqnum:
+            if self.base == TOTAL:
                 break
             self.event.clear()
+        self.close()
 
-    def receive_ack(self):
-        while True:
+    def receive(self):
+        while not (self.fin_acked.is_set() and self.peer_finished.is_set()):
             try:
                 buf, _ = self.sock.recvfrom(1024)
-                ack_packet = Packet.from_dict(marshal.loads(buf))
-                print(f"收到ACK: {ack_packet}")
-                self.ack_received[ack_packet.ack] = True
-                if ack_packet.ack == self.base:
-                    while self.ack_received[self.base]:
-                        self.base += 1
-                    self.event.set()
             except socket.timeout:
                 for i in range(self.base, self.nextseqnum):
                     self.send_packet(self.packets[i])
-
-    def receive_packet(self):
-        expected_seq = 0
-        while True:
-            try:
-                buf, _ = self.sock.recvfrom(1024)
-                packet = Packet.from_dict(marshal.loads(buf))
-                print(f"从服务器收到: {packet}")
-                if packet.seq == expected_seq:
-                    self.send_ack(packet.seq)
-                    expected_seq += 1
-                else:
-                    self.send_ack(expected_seq - 1)
-            except socket.timeout:
                 continue
+            packet = Packet.from_dict(marshal.loads(buf))
+            if packet.flag == FIN | ACK:
+                self.fin_acked.set()
+            elif packet.flag & FIN:
+                self.send_control(FIN | ACK)
+                self.peer_finished.set()
+            elif packet.flag & SYN:
+                continue
+            elif packet.flag & ACK:
+                self.receive_ack(packet)
+            else:
+                self.receive_packet(packet)
+        linger(self.sock, self.send_control)
+        print("客户端连接已关闭")
+
+    def receive_ack(self, ack_packet):
+        print(f"收到ACK: {ack_packet}")
+        self.ack_received[ack_packet.ack] = True
+        if ack_packet.ack == self.base:
+            while self.ack_received[self.base]:
+                self.base += 1
+            self.event.set()
+
+    def receive_packet(self, packet):
+        print(f"从服务器收到: {packet}")
+        if packet.seq == self.expected_seq:
+            self.send_ack(packet.seq)
+            self.expected_seq += 1
+        else:
+            self.send_ack(self.expected_seq - 1)
 
     def send_ack(self, ack):
-        ack_packet = Packet(ack=ack, seq=0, data='')
+        ack_packet = Packet(ack=ack, seq=0, data='', flag=ACK)
         self.sock.sendto(marshal.dumps(ack_packet.to_dict()), self.server)
         print(f"发送ACK: {ack_packet}")
 
 
+def linger(sock, send_control):
+    # 连接关闭后逗留一段时间，若本方的 FIN-ACK 丢失，对方重传的 FIN 仍能得到应答
+    sock.settimeout(LINGER)
+    while True:
+        try:
+            buf, _ = sock.recvfrom(1024)
+        except socket.timeout:
+            break
+        if Packet.from_dict(marshal.loads(buf)).flag == FIN:
+            send_control(FIN | ACK)
+
+
 def main():
     server_ins = Server((IP, PORT))
     client_ins = Client((IP, PORT))
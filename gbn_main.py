@@ -2,7 +2,15 @@
     欢迎使用我的本 GBN 协议模拟器！
     本 GBN 协议模拟器主要实现了下列功能：
     1. 基于 UDP 进行一个简单的 GBN（Go-back-N）协议实验模拟
-    2. 接收用户的输入（send、exit、clear 命令，自动检测输入是否为文件名，
+    2. 接收方通过 ACK 和 NAK 报文向发送方反馈接收情况，双方只通过 UDP 套接字通信
+    3. 可选的前向纠错（FEC），每 k 个数据包追加 r 个校验包，接收方可以直接恢复组内丢失的数据包
+    4. 把一个文件切分成多个字节区间，通过多个会话并行传输，由接收方写入输出文件的对应偏移处，
+    接收方在磁盘上记录已经写入的区间，中断后重新传输同一个文件时只发送缺失的部分
+    5. 提供非交互的命令行模式，便于在脚本中批量运行，并在结束时输出传输报告，
+    还可以按阶段统计发送和接收流程的耗时，或者在 cProfile 下运行
+    6. 可选的数据压缩，压缩效果越好每个数据包携带的数据越多，数据难以压缩时自动跳过压缩
+    7. 可选的路径 MTU 探测，发送方据此选择不会被分片的最大 MSS，并定期重新探测以适应路径的变化
+    8. 接收用户的输入（send、exit、clear 命令，自动检测输入是否为文件名，
     如果是，那么读取该文件内的数据，并将其存储在待发送的数据列表中）
     使用方法：
     1. 双击运行本文件，或者从终端中运行本文件
@@ -11,27 +19,90 @@
     3. 输入 send 命令并回车确认，即可开始 GBN 协议的模拟
     4. 输入 clear 命令并回车确认，即可将模拟器恢复至初始状态
     5. 输入 exit 命令并回车确认，即可退出本模拟器
+    6. 输入 stripe 命令、并行会话数、源文件和输出文件（例如 stripe 4 a.bin b.bin），即可进行多会话并行传输，
+    传输中断后再次执行相同的命令即可续传
+    命令行模式：
+    1. python gbn_main.py recv 输出文件或目录，启动接收方
+    2. python gbn_main.py send 文件...，启动发送方，文件名可以使用通配符，- 表示从标准输入读取
+    3. 使用 -h 参数可以查看窗口大小、超时时间、丢包率、MSS 等全部选项
+    4. 使用 --stages 参数按阶段统计耗时，使用 --cprofile 文件名 把 cProfile 的统计结果写入文件
 
     作者：李悠然
     作者的学号：2022405532
 """
 
+import argparse
+import bisect
 import glob
+import json
+import os
+import signal
+import sys
+import tempfile
 import socket
 import marshal
 import random
-from threading import Thread, Event
+import time
+from threading import Thread, Event, Lock
 from dataclasses import dataclass
 
+import compress
+import fec
+import pmtu
+import profiler
+
 IP = '127.0.0.1'
 PORT = 4567
 WINDOW_SIZE = 5
+MSS = 500
 LOST_POSSIBILITY = 0.2
+# 接收缓冲区大小，需要能容纳 MSS 个字符编码后的数据包和比数据包略大的校验包
+BUFFER_SIZE = 65535
+# 前向纠错参数 (k, r)：每 k 个数据包追加 r 个校验包，为 None 时不启用
+FEC = None
+# 数据压缩参数 (编码, 压缩级别)，为 None 时不压缩
+COMPRESS = None
+# 是否在会话开始时探测路径 MTU 并据此选择 MSS，以及每隔多少秒重新探测一次
+PMTU = False
+REPROBE_INTERVAL = 5.0
+# 单个探测报文等待回复的时间（秒）和重试次数
+PROBE_TIMEOUT = 0.05
+PROBE_RETRY = 2
+# 连续超时达到该次数时怀疑路径 MTU 变小导致数据包被丢弃，立即重新探测
+BLACKHOLE_TIMEOUTS = 3
+# 接收方每写入多少个数据包就把进度日志落盘一次
+JOURNAL_BATCH = 64
+# 为 False 时不输出每个会话和每个数据包的过程信息，批量运行时可以减少输出的开销
+VERBOSE = True
+
+# 命令行模式的退出码，参数错误时由 argparse 以 2 退出
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+# 发送方等待 ACK 或 NAK 的超时时间（秒），超时后回退到窗口的起点重传
+TIMEOUT = 0.5
+# 连续超时达到该次数时认为接收方已不可达，放弃本次会话
+MAX_TIMEOUTS = 20
+# 握手与挥手阶段单次等待应答的时间（秒）和最大重试次数
+HANDSHAKE_TIMEOUT = 0.2
+HANDSHAKE_RETRY = 5
+# 接收方回复 FIN-ACK 之后继续逗留的时间（秒），需要大于 HANDSHAKE_TIMEOUT 才能应答对方重传的 FIN
+LINGER = 0.5
 
-# 将重传事件和重传序号设为全局变量，由发送方和接收方共享
-GLOBAL_EVENT = Event()
-RETRANSFER_SEQ = 0
+# 解析报文时可能引发的异常：端口上收到的不是本协议的报文，或者报文已经损坏，此时直接丢弃它
+MALFORMED = (ValueError, EOFError, TypeError, KeyError)
 
+# 报文首部的标志位，参照 TCP 使用位掩码表示，例如 SYN | ACK 即为 SYN-ACK 报文
+DATA = 0
+SYN = 1
+ACK = 2
+FIN = 4
+NAK = 8
+PARITY = 16
+# 数据包的内容经过了压缩，接收方需要先解压
+COMPRESSED = 32
+# 路径 MTU 探测报文，PROBE | ACK 为接收方的回复
+PROBE = 64
 
 
 """
@@ -41,43 +112,427 @@ RETRANSFER_SEQ = 0
 class packet:
     ack: int
     seq: int
-    data: str = ''
+    data: bytes = b''
+    flag: int = DATA
 
     def to_dict(self):
         return {
             'ack': self.ack,
             'seq': self.seq,
-            'data': self.data
+            'data': self.data,
+            'flag': self.flag
         }
 
     @staticmethod
     def from_dict(dict: dict):
-        return packet(dict['ack'], dict['seq'], dict['data'])
+        ins = packet(dict['ack'], dict['seq'], dict['data'], dict.get('flag', DATA))
+        if not all(isinstance(value, int) for value in (ins.ack, ins.seq, ins.flag)):
+            raise TypeError('报文首部的字段不是整数')
+        return ins
+
+    def encode(self) -> bytes:
+        return marshal.dumps(self.to_dict())
+
+    @staticmethod
+    def decode(buf: bytes):
+        return packet.from_dict(marshal.loads(buf))
+
+
+def log(message: str):
+    if VERBOSE:
+        print(message)
+
+
+class chunks:
+    """
+        把文件中的若干个 [beg, end) 区间按 mss 依次切分成数据块，只在取用时才读取文件，大文件不必整个读入内存
+    """
+
+    def __init__(self, path: str, ranges: list, mss: int) -> None:
+        self.file = open(path, 'rb')
+        self.mss = mss
+        # 每个区间的第一个数据块的下标，以及区间本身
+        self.firsts = []
+        self.ranges = []
+        self.count = 0
+        self.size = 0
+        for beg, end in ranges:
+            if end > beg:
+                self.firsts.append(self.count)
+                self.ranges.append((beg, end))
+                self.count += (end - beg + mss - 1) // mss
+                self.size += end - beg
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        which = bisect.bisect_right(self.firsts, index) - 1
+        beg, end = self.ranges[which]
+        off = beg + (index - self.firsts[which]) * self.mss
+        self.file.seek(off)
+        return self.file.read(min(self.mss, end - off))
+
+    def remaining(self, index: int) -> list:
+        """
+            返回从第 index 个数据块开始的数据在文件中所占的区间
+        """
+        if index >= self.count:
+            return []
+        which = bisect.bisect_right(self.firsts, index) - 1
+        beg, end = self.ranges[which]
+        return [(beg + (index - self.firsts[which]) * self.mss, end)] + self.ranges[which + 1:]
+
+    def flag(self, index: int) -> int:
+        return DATA
+
+    def discard(self, index: int):
+        pass
+
+    def close(self):
+        self.file.close()
+
+
+class segments:
+    """
+        经过压缩阶段的数据：随着发送窗口向前移动，把文件中的若干个 [beg, end) 区间逐个打包成数据段。
+        只有已打包且尚未被 discard 的数据段保存在内存中，跳过压缩的数据段只记录位置，在取用时才读取文件。
+        打包总是比已取用的数据段多进行一个，因此 len() 恰好能说明下一个数据段是否存在
+    """
+
+    def __init__(self, path: str, ranges: list, compressor: compress.Compressor) -> None:
+        self.file = open(path, 'rb')
+        self.compressor = compressor
+        # 下标 -> (偏移, 长度, 压缩后的数据)，没有压缩时最后一项为 None，下标小于 low 的数据段已被丢弃
+        self.items = {}
+        self.low = 0
+        self.count = 0
+        self.ranges = [(beg, end) for beg, end in ranges if end > beg]
+        self.size = sum(end - beg for beg, end in self.ranges)
+        self.packer = self.pack()
+        self.ahead = next(self.packer, None)
+
+    def pack(self):
+        for beg, end in self.ranges:
+            yield from self.compressor.pack(self.read, beg, end)
+
+    def fill(self, index: int):
+        """
+            打包到第 index 个数据段为止，并预先打包它的下一个数据段
+        """
+        while self.count <= index and self.ahead is not None:
+            self.items[self.count] = self.ahead
+            self.count += 1
+            self.ahead = next(self.packer, None)
+
+    def read(self, off: int, size: int) -> bytes:
+        self.file.seek(off)
+        return self.file.read(size)
+
+    def __len__(self):
+        return self.count + (self.ahead is not None)
+
+    def item(self, index: int) -> tuple:
+        if index < self.low:
+            raise IndexError('第 ' + str(index) + ' 个数据段已被丢弃')
+        self.fill(index)
+        if index not in self.items:
+            raise IndexError(index)
+        return self.items[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        off, size, payload = self.item(index)
+        return self.read(off, size) if payload is None else payload
+
+    def flag(self, index: int) -> int:
+        return DATA if self.item(index)[2] is None else COMPRESSED
+
+    def remaining(self, index: int) -> list:
+        if index >= len(self):
+            return []
+        off = self.item(index)[0]
+        which = bisect.bisect_right([beg for beg, _ in self.ranges], off) - 1
+        return [(off, self.ranges[which][1])] + self.ranges[which + 1:]
+
+    def discard(self, index: int):
+        """
+            丢弃下标小于 index 的数据段，它们已经被确认，不会再被发送
+        """
+        while self.low < min(index, self.count):
+            del self.items[self.low]
+            self.low += 1
+
+    def close(self):
+        self.file.close()
+
+
+class spliced:
+    """
+        会话中途按新的 MSS 重新分段后的数据：下标小于 base 的数据包仍然来自 head，其余的来自重新分段得到的 tail
+    """
+
+    def __init__(self, head, base: int, tail) -> None:
+        self.head = head
+        self.base = base
+        self.tail = tail
+
+    def __len__(self):
+        return self.base + len(self.tail)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.head[index] if index < self.base else self.tail[index - self.base]
+
+    def remaining(self, index: int) -> list:
+        return self.head.remaining(index) if index < self.base else self.tail.remaining(index - self.base)
+
+    def flag(self, index: int) -> int:
+        return self.head.flag(index) if index < self.base else self.tail.flag(index - self.base)
+
+    def discard(self, index: int):
+        self.head.discard(min(index, self.base))
+        self.tail.discard(index - self.base)
+
+    def close(self):
+        self.head.close()
+        self.tail.close()
+
+
+class journal:
+    """
+        接收方的进度日志，以有序的区间列表记录已经写入输出文件的字节范围，保存为输出文件旁的 .journal 文件
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.size = None
+        # 源文件的标识（大小和修改时间），用于区分大小相同的不同文件
+        self.source = None
+        self.ranges = []
+        self.pending = 0
+
+    def load(self, size: int, source: str = None) -> bool:
+        """
+            读取磁盘上的日志，只有日志存在且记录的文件大小和源文件标识都与本次传输一致时才返回 True
+        """
+        try:
+            with open(self.path) as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if saved.get('size') != size or saved.get('source') != source:
+            return False
+        self.size = size
+        self.source = source
+        self.ranges = [list(r) for r in saved['ranges']]
+        return True
+
+    def reset(self, size: int, source: str = None):
+        self.size = size
+        self.source = source
+        self.ranges = []
+        self.pending = 0
+
+    def add(self, beg: int, end: int):
+        merged = []
+        for a, b in sorted(self.ranges + [[beg, end]]):
+            if merged and a <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], b)
+            else:
+                merged.append([a, b])
+        self.ranges = merged
+        self.pending += 1
+
+    def missing(self, beg: int, end: int) -> list:
+        """
+            返回 [beg, end) 中还没有写入的区间
+        """
+        holes = []
+        pos = beg
+        for a, b in self.ranges:
+            if b <= pos:
+                continue
+            if a >= end:
+                break
+            if a > pos:
+                holes.append((pos, a))
+            pos = max(pos, b)
+        if pos < end:
+            holes.append((pos, end))
+        return holes
+
+    def complete(self) -> bool:
+        return self.size is not None and not self.missing(0, self.size)
+
+    def save(self):
+        """
+            先写入临时文件并 fsync，再原子地替换旧日志，进程在任何时刻退出都不会留下损坏的日志
+        """
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump({'size': self.size, 'source': self.source, 'ranges': self.ranges}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.path)
+        self.pending = 0
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class assembler:
+    """
+        接收方的组装器：按发送方给出的文件大小预先分配输出文件，各个会话把收到的数据写入各自区间的偏移处，
+        并通过进度日志记录已经写入的区间
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = None
+        self.lock = Lock()
+        self.journal = journal(path + '.journal')
+
+    def allocate(self, size: int, source: str = None):
+        with self.lock:
+            if self.file is None:
+                # 只有日志记录的是同一个源文件，并且输出文件的大小与它一致时才续传，否则从头开始
+                resume = self.journal.load(size, source) and os.path.isfile(self.path) \
+                    and os.path.getsize(self.path) == size
+                if not resume:
+                    self.journal.reset(size, source)
+                self.file = open(self.path, 'r+b' if resume else 'w+b')
+                self.file.truncate(size)
+
+    def missing(self, beg: int, end: int) -> list:
+        with self.lock:
+            return self.journal.missing(beg, end)
+
+    def write(self, off: int, data: bytes):
+        with self.lock:
+            self.file.seek(off)
+            self.file.write(data)
+            self.journal.add(off, off + len(data))
+            if self.journal.pending >= JOURNAL_BATCH:
+                self.sync()
+
+    def sync(self):
+        """
+            先把数据 fsync 到磁盘再保存日志，保证日志中记录的区间一定已经写入，调用时需要持有锁
+        """
+        if self.file is None or self.journal.pending == 0:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.journal.save()
+
+    def flush(self):
+        with self.lock:
+            self.sync()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.sync()
+                self.file.close()
+                self.file = None
+                # 传输完成后日志就没有用了，删除它以免影响下一次写入同一个文件
+                if self.journal.complete():
+                    self.journal.remove()
+
+
+class storage:
+    """
+        接收方的输出位置：path 为目录时，每个文件按发送方给出的文件名保存在该目录下，否则所有会话都写入 path。
+        同一个文件的多个并行会话共用一个组装器，最后一个会话结束时关闭它
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = Lock()
+        # 文件路径 -> [组装器, 正在使用它的会话数]
+        self.files = {}
+        self.completed = 0
+        # 文件路径 -> 本次运行中写入它的源文件标识，以及因为与之冲突而被拒绝的 (文件路径, 源文件标识)
+        self.sources = {}
+        self.rejected = set()
+
+    def acquire(self, name: str, source: str = None) -> assembler:
+        """
+            返回写入 name 的组装器。不同目录下的同名文件会保存到同一个路径，因此本次运行中该路径已经属于另一个源文件时
+            抛出 FileExistsError，而不是覆盖它；同一个源文件再次传输（例如中断后续传）不受影响
+        """
+        path = self.path
+        if os.path.isdir(path):
+            path = os.path.join(path, os.path.basename(name) or 'unnamed')
+        with self.lock:
+            if self.sources.setdefault(path, source) != source:
+                self.rejected.add((path, source))
+                raise FileExistsError('本次运行中已经收到过另一个同名的文件，为避免覆盖，拒绝写入 ' + path)
+            entry = self.files.setdefault(path, [assembler(path), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, output: assembler):
+        with self.lock:
+            entry = self.files[output.path]
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self.files[output.path]
+            output.close()
+            if output.journal.complete():
+                self.completed += 1
 
 
 class server:
     """
-        这是用于实现 GBN 协议的接收方的类，如果能够在它的内部对 client 进行通信，那么程序可能会更加简洁
+        这是用于实现 GBN 协议的接收方的类，它只接收按序到达的数据包，并用累积 ACK 进行确认，
+        发现缺口时通过 NAK 报文把缺失的序号告知发送方
     """
     ack = 0
     seq = 0
 
-    def __init__(self, addr, event: Event) -> None:
+    def __init__(self, addr, event: Event, output: storage = None) -> None:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind(addr)
-        self.client = addr
+        # 发送方的地址在握手时从 SYN 报文中得到
+        self.client = None
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.settimeout(5)
+        # 超时时间较短，使得输入 exit 后接收方能够尽快退出
+        self.sock.settimeout(HANDSHAKE_TIMEOUT)
         self.event = event
         self.window_size = WINDOW_SIZE
+        self.mss = MSS
         self.s_beg = 0
         self.s_end = self.s_beg + WINDOW_SIZE
-
-    @property
-    def next_seq(self):
-        ret_seq = self.seq
-        self.seq += 1
-        return ret_seq
+        # 最近一次发送 NAK 时缺失的序号，以及触发它的数据包的序号。同一个缺口在发送方回退之前只通知一次，
+        # 序号不超过 nak_mark 的数据包到达说明发送方已经回退，此时缺口仍在则说明重传的数据包又丢失了，可以再次通知
+        self.nak_seq = -1
+        self.nak_mark = -1
+        self.fec = None
+        self.groups = {}
+        # 协商后使用的压缩编码，为 None 时不启用压缩
+        self.codec = None
+        # 发送方分段的版本号，发送方按新的 MSS 重新分段后，版本号较小的数据包和校验包都会被丢弃
+        self.epoch = 0
+        # output 为 None 或发送方没有给出文件大小时把收到的数据打印出来，否则写入 file 这个组装器，
+        # pos 为下一个数据包在文件中的偏移，holes 为本次会话需要填补的区间，hole 为当前正在填补的区间下标
+        self.output = output
+        self.file = None
+        self.pos = 0
+        self.holes = []
+        self.hole = 0
+        self.finished = Event()
+        # 本方收到的有效数据字节数，以及第一次建立连接和最后一次收到 FIN 的时间，用于统计吞吐量
+        self.received = 0
+        self.started = None
+        self.ended = None
 
     @property
     def next_ack(self):
@@ -85,42 +540,258 @@ class server:
         self.ack += 1
         return ret_ack
 
-    def send(self, message: str):
-        self.sock.sendto(marshal.dumps(
-            packet(self.next_ack, self.seq + 1).to_dict()), self.client)
+    def reply(self, flag: int, data=''):
+        """
+            向发送方回复报文，ack 字段为期望收到的下一个 seq，即累积确认号
+        """
+        self.sock.sendto(packet(self.seq, self.next_ack, data, flag).encode(), self.client)
 
-    def notify_retransfer(self):
-        global GLOBAL_EVENT
-        global RETRANSFER_SEQ
-        GLOBAL_EVENT.set()
-        RETRANSFER_SEQ = self.seq
-        self.send('接收方要求重传，具体 seq 在报文首部中给出')
+    def accept(self, syn: packet, addr):
+        """
+            处理发送方的 SYN 报文：取双方窗口大小和 MSS 中较小的值作为本次会话的参数，并回复 SYN-ACK
+        """
+        options = syn.data if isinstance(syn.data, dict) else {}
+        self.client = addr
+        if self.started is None:
+            self.started = time.monotonic()
+        # SYN 报文的 seq 为发送方本次会话的起始序号
+        self.ack = 0
+        self.seq = syn.seq
+        self.epoch = syn.ack
+        self.nak_seq = -1
+        self.window_size = min(WINDOW_SIZE, options.get('window', WINDOW_SIZE))
+        self.mss = min(MSS, options.get('mss', MSS))
+        # FEC 由发送方按会话决定，接收方照单全收；压缩只在本方支持该编码时启用
+        self.fec = options.get('fec')
+        self.codec = options.get('compress') if options.get('compress') in compress.CODECS else None
+        # 接收缓冲区需要能容纳两个窗口的数据包和校验包，MSS 较大时系统默认的缓冲区可能会溢出
+        want = 2 * self.window_size * min(self.mss + 1024, BUFFER_SIZE)
+        if self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) < want:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, want)
+        self.groups = {}
+        self.pos = options.get('offset', 0)
+        self.holes = []
+        self.hole = 0
+        negotiated = {'window': self.window_size, 'mss': self.mss, 'fec': self.fec, 'compress': self.codec}
+        if self.output is not None and 'size' in options:
+            # 根据进度日志告诉发送方本区间中还缺少哪些部分，发送方只需要依次发送这些部分
+            size = options['size']
+            if self.file is not None:
+                self.output.release(self.file)
+                self.file = None
+            try:
+                self.file = self.output.acquire(options.get('name', ''), options.get('source'))
+            except FileExistsError as e:
+                log(str(e))
+                self.reply(SYN | ACK, {'error': str(e)})
+                return
+            self.file.allocate(size, options.get('source'))
+            self.holes = self.file.missing(self.pos, options.get('end', size))
+            negotiated['missing'] = self.holes
+            if self.holes:
+                self.pos = self.holes[0][0]
+        self.reply(SYN | ACK, negotiated)
+        log('已与发送方 ' + str(addr) + ' 建立连接，窗口大小为 ' +
+            str(self.window_size) + '，MSS 为 ' + str(self.mss) +
+            ('，FEC 参数为 ' + str(self.fec) if self.fec else ''))
+
+    def linger(self):
+        """
+            回复 FIN-ACK 之后短暂逗留，若 FIN-ACK 丢失，发送方重传的 FIN 仍能得到应答
+        """
+        deadline = time.monotonic() + LINGER
+        while time.monotonic() < deadline:
+            self.sock.settimeout(max(deadline - time.monotonic(), 0.001))
+            try:
+                buf, addr = self.sock.recvfrom(BUFFER_SIZE)
+            except socket.timeout:
+                break
+            try:
+                data_ins = packet.decode(buf)
+            except MALFORMED:
+                continue
+            if data_ins.flag & SYN:
+                # 发送方已经开始了下一次会话，无需继续逗留
+                self.accept(data_ins, addr)
+                break
+            if data_ins.flag & FIN and addr == self.client:
+                self.reply(FIN | ACK)
+        self.sock.settimeout(HANDSHAKE_TIMEOUT)
+
+    def notify_retransfer(self, end: int):
+        """
+            通过 NAK 报文告知发送方缺失的序号范围 [self.seq, end)，发送方收到后会立即回退到 self.seq，
+            若 NAK 丢失则由发送方的超时重传兜底
+        """
+        if self.nak_seq == self.seq and end > self.nak_mark:
+            return
+        self.nak_seq = self.seq
+        self.nak_mark = end
+        log('发送方存在丢包现象，需要重传 seq 为 ' + str(self.seq) + ' 的包')
+        self.reply(NAK, end)
+
+    def deliver(self, data_ins: packet) -> bool:
+        """
+            按序交付一个数据包，压缩的数据包无法解压（未协商压缩、数据损坏或解压后过大）时丢弃它并返回 False
+        """
+        data = data_ins.data
+        if data_ins.flag & COMPRESSED:
+            try:
+                if self.codec is None:
+                    raise ValueError('本次会话没有协商压缩')
+                data = compress.decompress(data, self.mss, self.codec)
+            except ValueError as e:
+                log('丢弃 seq 为 ' + str(data_ins.seq) + ' 的数据包，无法解压：' + str(e))
+                return False
+        if self.file is None:
+            log('已经收到来自客户端的消息：' + data.decode(errors='replace') + '\n'
+                + 'seq: ' + str(data_ins.seq) + '\n')
+        else:
+            log('已将 seq 为 ' + str(data_ins.seq) + ' 的数据包写入偏移 ' + str(self.pos) + ' 处')
+            self.file.write(self.pos, data)
+        self.pos += len(data)
+        self.received += len(data)
+        self.seq += 1
+        if self.hole + 1 < len(self.holes) and self.pos >= self.holes[self.hole][1]:
+            self.hole += 1
+            self.pos = self.holes[self.hole][0]
+        return True
+
+    def advance(self, epoch: int):
+        """
+            发送方已经按新的 MSS 重新分段，丢弃缓存中尚未交付的数据包和全部校验包，已交付的数据包仍可用于 FEC 恢复
+        """
+        self.epoch = epoch
+        self.nak_seq = -1
+        if self.fec is None:
+            return
+        k = self.fec[0]
+        current = self.groups.get(self.seq // k)
+        self.groups = {}
+        if current is not None:
+            group = self.group(self.seq // k)
+            for index, block in current.blocks.items():
+                if self.seq // k * k + index < self.seq:
+                    group.add_data(index, block, current.flags.get(index, DATA))
+
+    def answer_probe(self, probe: packet, size: int):
+        """
+            回复路径 MTU 探测报文：data 为收到的报文长度，ack 为期望收到的下一个 seq
+        """
+        if probe.ack > self.epoch:
+            self.advance(probe.ack)
+        self.reply(PROBE | ACK, size)
+
+    def receive_data(self, data_ins: packet):
+        # 数据包的 ack 字段为发送方分段的版本号
+        if data_ins.ack < self.epoch:
+            return
+        if data_ins.ack > self.epoch:
+            self.advance(data_ins.ack)
+        if data_ins.seq < self.seq:
+            # 重复的数据包说明之前的 ACK 丢失，重新确认一次
+            self.reply(ACK)
+        elif self.fec is not None:
+            k = self.fec[0]
+            group = data_ins.seq // k
+            self.group(group).add_data(data_ins.seq % k, data_ins.data, data_ins.flag)
+            self.drain()
+            # 只有后一组的数据包到达时，才能确定当前组的缺口无法由校验包恢复
+            if self.seq < data_ins.seq and self.seq // k < group:
+                self.notify_retransfer(data_ins.seq)
+        elif data_ins.seq == self.seq:
+            if self.deliver(data_ins):
+                self.reply(ACK)
+        else:
+            self.notify_retransfer(data_ins.seq)
+
+    def receive_parity(self, parity: packet):
+        if parity.seq < self.seq // self.fec[0] or parity.data.get('epoch', 0) < self.epoch:
+            return
+        self.group(parity.seq).add_parity(parity.ack, parity.data)
+        self.drain()
+
+    def group(self, index: int) -> fec.FecGroup:
+        if index not in self.groups:
+            self.groups[index] = fec.FecGroup(self.fec[1])
+        return self.groups[index]
+
+    def drain(self):
+        """
+            按序交付已经缓存的数据包，缺少下一个数据包时先尝试用校验包恢复它
+        """
+        k = self.fec[0]
+        delivered = False
+        while True:
+            group, index = divmod(self.seq, k)
+            if group not in self.groups:
+                break
+            blocks = self.groups[group].blocks
+            if index not in blocks:
+                for i in self.groups[group].recover():
+                    log('已通过 FEC 恢复 seq 为 ' + str(group * k + i) + ' 的数据包')
+                if index not in blocks:
+                    break
+            if not self.deliver(packet(0, self.seq, blocks[index], self.groups[group].flags.get(index, DATA))):
+                # 丢弃无法解压的数据包，发送方超时后会重传它
+                del blocks[index]
+                break
+            delivered = True
+            if self.seq % k == 0:
+                del self.groups[group]
+        if delivered:
+            self.reply(ACK)
 
     def server_start(self):
         while not self.event.is_set():
             try:
-                buf = self.sock.recvfrom(1024)
+                buf, addr = self.sock.recvfrom(BUFFER_SIZE)
             except:
                 if self.event.is_set():
-                    print('模拟器已退出')
+                    if self.file is not None:
+                        self.output.release(self.file)
+                        self.file = None
+                    log('模拟器已退出')
                     break
                 else:
                     continue
-            if random.random() > LOST_POSSIBILITY:
+            try:
+                data_ins = packet.decode(buf)
+            except MALFORMED:
+                log('丢弃一个来自 ' + str(addr) + ' 的无法解析的报文')
+                continue
+            if data_ins.flag & SYN:
+                self.accept(data_ins, addr)
+                continue
+            if data_ins.flag & FIN:
+                self.client = addr
+                self.reply(FIN | ACK)
+                self.ended = time.monotonic()
+                if self.file is not None:
+                    self.output.release(self.file)
+                    self.file = None
+                self.finished.set()
+                self.linger()
+                log('发送方已关闭连接，本次会话结束')
+                continue
+            if data_ins.flag & PROBE:
+                self.answer_probe(data_ins, len(buf))
                 continue
-            data_ins = packet.from_dict(marshal.loads(buf[0]))
-            print('已经收到来自客户端的消息：' + data_ins.data + '\n'
-                  + '绝对传送次数: ' + str(data_ins.seq + 1) + '\n')
-            if data_ins.seq > self.seq + 1:
-                print('发送方存在丢包现象，需要重传 seq 为 ' + str(self.seq) + ' 的包')
-                self.notify_retransfer()
+            if random.random() < LOST_POSSIBILITY:
+                log('模拟丢包：seq 为 ' + str(data_ins.seq) + ' 的' +
+                    ('校验包' if data_ins.flag & PARITY else '数据包') + '被丢弃')
+                continue
+            if data_ins.flag & PARITY:
+                if self.fec is not None:
+                    self.receive_parity(data_ins)
             else:
-                self.seq = data_ins.seq + 1
+                self.receive_data(data_ins)
 
 
 class client:
     """
-        这是用于实现 GBN 协议的发送方的类，它维护了一个发送窗口，其大小默认为 5
+        这是用于实现 GBN 协议的发送方的类，它维护了一个发送窗口，其大小默认为 5，
+        s_beg 为窗口中最早的未确认序号，seq 为下一个待发送的序号
     """
     ack = 0
     seq = 0
@@ -128,50 +799,345 @@ class client:
     def __init__(self, addr, event: Event) -> None:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.settimeout(2)
+        self.sock.settimeout(TIMEOUT)
         self.server = addr
         self.event = event
         self.window_size = WINDOW_SIZE
+        self.mss = MSS
         self.s_beg = 0
-        self.s_end = self.s_beg + WINDOW_SIZE
         self.max = 0
         self.data = []
+        self.fec = FEC
+        # 数据压缩参数、协商后使用的编码，以及交互模式下 data 中经过压缩的数据包的下标
+        self.compress = COMPRESS
+        self.codec = None
+        self.compressed = set()
+        # 是否探测路径 MTU、接收方允许的最大 MSS，以及下一次重新探测的时间
+        self.pmtu = PMTU
+        self.limit = MSS
+        self.reprobe_at = None
+        # 握手时测得的往返时间，用于确定等待探测报文回复的时间
+        self.rtt = 0.0
+        if self.pmtu and not pmtu.set_dont_fragment(self.sock):
+            log('本平台无法为报文设置 DF 标志，只能探测出直接丢弃大报文的路径')
+        # 本次会话负责的文件、区间 [offset, end) 和文件的总大小，只在多会话并行传输时使用
+        self.path = None
+        self.name = None
+        self.offset = 0
+        self.end = None
+        self.size = None
+        # 源文件的标识，接收方据此判断磁盘上的进度日志是否属于同一个文件
+        self.source = None
+        # 统计信息：本次会话需要送达的字节数、发送的数据包数及其数据的总字节数、其中重传的个数，以及是否全部送达
+        self.bytes = 0
+        self.sent = 0
+        self.wire = 0
+        self.retransmits = 0
+        self.high = 0
+        self.completed = False
 
-    @property
-    def next_seq(self):
-        ret_seq = self.seq
-        self.seq += 1
-        return ret_seq
+    def send(self, seq: int):
+        self.sent += 1
+        if seq < self.high:
+            self.retransmits += 1
+        else:
+            self.high = seq + 1
+        data = self.data[seq]
+        # 压缩时数据段是逐个打包的，取用一个数据段之后才能确定它是否为最后一个
+        self.max = len(self.data)
+        self.wire += len(data)
+        self.sock.sendto(packet(self.ack, seq, data, self.flag(seq)).encode(), self.server)
+        if self.fec is not None:
+            k, r = self.fec
+            if (seq + 1) % k == 0 or seq + 1 == self.max:
+                self.send_parity(seq // k)
 
-    @property
-    def next_ack(self):
-        ret_ack = self.ack
+    def send_parity(self, group: int):
+        """
+            一组数据包发送完毕后紧接着发送它的 r 个校验包，校验包的 seq 为组号，ack 为组内的校验下标
+        """
+        k, r = self.fec
+        blocks = self.data[group * k:(group + 1) * k]
+        flags = [self.flag(seq) for seq in range(group * k, group * k + len(blocks))]
+        for index, payload in enumerate(fec.encode(blocks, r, flags=flags)):
+            payload['epoch'] = self.ack
+            self.sock.sendto(packet(index, group, payload, PARITY).encode(), self.server)
+
+    def flag(self, seq: int) -> int:
+        if isinstance(self.data, list):
+            return COMPRESSED if seq in self.compressed else DATA
+        return self.data.flag(seq)
+
+    def request(self, flag: int, data, expect: int):
+        """
+            发送一个控制报文并等待带有 expect 标志的应答，超时后重传，重试次数用尽时返回 None
+        """
+        self.sock.settimeout(HANDSHAKE_TIMEOUT)
+        start = time.monotonic()
+        try:
+            for _ in range(HANDSHAKE_RETRY):
+                self.sock.sendto(packet(self.ack, self.seq, data, flag).encode(), self.server)
+                deadline = time.monotonic() + HANDSHAKE_TIMEOUT
+                while time.monotonic() < deadline:
+                    try:
+                        buf, _ = self.sock.recvfrom(BUFFER_SIZE)
+                    except socket.timeout:
+                        break
+                    try:
+                        reply = packet.decode(buf)
+                    except MALFORMED:
+                        continue
+                    if reply.flag == expect:
+                        # 应答可能属于更早的一次发送，从第一次发送开始计时，得到的往返时间只会偏大
+                        self.rtt = time.monotonic() - start
+                        return reply
+        finally:
+            self.sock.settimeout(TIMEOUT)
+        return None
+
+    def connect(self):
+        """
+            三次握手中的前两步：发送 SYN 报文携带本方的窗口大小和 MSS，由接收方在 SYN-ACK 中给出协商结果
+        """
+        # 从第一个未被确认的数据包开始新的会话，之前已经送达的数据不会重复发送
+        self.ack = 0
+        self.seq = self.s_beg
+        # 探测路径 MTU 时请求接收方允许的最大 MSS，实际使用的 MSS 由探测结果决定
+        options = {'window': WINDOW_SIZE, 'mss': pmtu.MAX_DATAGRAM if self.pmtu else MSS,
+                   'fec': self.fec, 'offset': self.offset,
+                   'compress': self.compress[0] if self.compress else None}
+        if self.size is not None:
+            options['size'] = self.size
+            options['end'] = self.end
+            options['name'] = self.name
+            options['source'] = self.source
+        reply = self.request(SYN, options, SYN | ACK)
+        if reply is None:
+            log('无法与接收方建立连接，请稍后重试')
+            return False
+        if reply.data.get('error'):
+            log('接收方拒绝了本次传输：' + reply.data['error'])
+            return False
+        self.window_size = reply.data['window']
+        self.limit = reply.data['mss']
+        self.mss = min(MSS, self.limit)
+        if self.pmtu:
+            self.mss = self.discover() or self.mss
+        self.codec = reply.data.get('compress') if self.compress else None
+        if self.path is not None:
+            # 接收方已经有了部分数据时，只发送它缺少的区间
+            missing = reply.data.get('missing', [(self.offset, self.end)])
+            self.data.close()
+            self.data = self.segment(missing)
+            self.max = len(self.data)
+            skipped = self.end - self.offset - sum(end - beg for beg, end in missing)
+            if skipped > 0:
+                log('接收方已有 ' + str(skipped) + ' 字节，本次只发送缺失的 ' + str(len(missing)) + ' 个区间')
+        self.high = self.seq
+        if isinstance(self.data, (chunks, segments)):
+            self.bytes = self.data.size
+        else:
+            self.bytes = sum(len(message) for message in self.data[self.seq:])
+        log('连接已建立，窗口大小为 ' + str(self.window_size) + '，MSS 为 ' + str(self.mss))
+        return True
+
+    def segment(self, ranges: list):
+        """
+            按当前的 MSS 把文件中的若干个区间切分成数据包，协商启用了压缩时经过压缩阶段
+        """
+        if self.codec is not None:
+            return segments(self.path, ranges, compress.Compressor(self.mss, self.codec, self.compress[1]))
+        return chunks(self.path, ranges, self.mss)
+
+    def overhead(self) -> int:
+        """
+            数据包和校验包中除数据以外的部分最多占用的字节数
+        """
+        big = 2 ** 31 - 1
+        size = len(packet(big, big, b'', COMPRESSED).encode())
+        if self.fec is not None:
+            k, r = self.fec
+            payload = fec.encode([b''] * k, r)[0]
+            payload.update(lens=[big - i for i in range(k)], flags=[big - i for i in range(k)], epoch=big)
+            size = max(size, len(packet(big, big, payload, PARITY).encode()))
+        return size
+
+    def probe(self, size: int) -> bool:
+        """
+            发送一个长度为 size 的探测报文，收到接收方对它的回复时返回 True，
+            回复中的 ack 为接收方期望收到的下一个 seq，它之前的数据包都已送达
+        """
+        header = len(packet(self.ack, self.seq, b'', PROBE).encode())
+        buf = packet(self.ack, self.seq, bytes(max(size - header, 0)), PROBE).encode()
+        # 往返时间较长的路径上回复来得较晚，等待的时间至少为两倍的往返时间
+        timeout = max(PROBE_TIMEOUT, 2 * self.rtt)
+        self.sock.settimeout(timeout)
+        try:
+            for _ in range(PROBE_RETRY):
+                try:
+                    self.sock.sendto(buf, self.server)
+                except OSError:
+                    # 报文超过了本机已知的路径 MTU，内核直接拒绝发送
+                    return False
+                deadline = time.monotonic() + timeout
+                while time.monotonic() < deadline:
+                    try:
+                        reply, _ = self.sock.recvfrom(BUFFER_SIZE)
+                    except socket.timeout:
+                        break
+                    try:
+                        reply = packet.decode(reply)
+                    except MALFORMED:
+                        continue
+                    if reply.flag == PROBE | ACK and reply.data == len(buf):
+                        self.s_beg = min(max(self.s_beg, reply.ack), self.max)
+                        return True
+                    # 传输途中重新探测时，仍然处理接收方对数据包的 ACK 和 NAK
+                    self.slide(reply)
+        finally:
+            self.sock.settimeout(TIMEOUT)
+        return False
+
+    def discover(self, full: bool = True):
+        """
+            探测能够到达接收方的最大报文长度，返回据此得到的 MSS，探测失败时返回 None。
+            full 为 True 时在整个范围内二分查找；否则先确认当前的报文长度仍然能够到达，再尝试高一级的平台，
+            只有两者之一的结果与之前不同时才向下或向上查找，路径没有变化时只需要两个探测报文。
+            探测报文的 ack 字段为当前的分段版本号，探测本身不会使接收方丢弃任何数据包
+        """
+        overhead = self.overhead()
+        high = min(pmtu.MAX_DATAGRAM, self.limit + overhead)
+        low = min(pmtu.MIN_DATAGRAM, high)
+        current = min(self.mss + overhead, high)
+        if full or current <= low:
+            size = pmtu.search(self.probe, low, high)
+        elif not self.probe(current):
+            # 当前的报文已经无法到达接收方，路径 MTU 变小了
+            size = pmtu.search(self.probe, low, max(low, current - pmtu.GRANULE))
+        else:
+            # 当前的长度由二分查找得到，可能比实际的上限小 GRANULE 以内，高一级的平台需要越过这段误差
+            step = pmtu.next_plateau(current + pmtu.GRANULE, high)
+            size = pmtu.search(self.probe, step, high) if step > current and self.probe(step) else current
+        self.reprobe_at = time.monotonic() + REPROBE_INTERVAL
+        if size is None:
+            log('路径 MTU 探测失败，继续使用 MSS ' + str(self.mss))
+            return None
+        log('路径 MTU 探测完成，能够到达接收方的最大报文为 ' + str(size) + ' 字节')
+        return size - overhead
+
+    def reprobe(self, full: bool = False):
+        """
+            重新探测路径 MTU，MSS 发生变化时把尚未确认的数据按新的 MSS 重新分段，已确认的数据包保持不变。
+            定期的重新探测只检查当前的 MSS 和高一级的平台，full 为 True 时完整地查找
+        """
+        mss = self.discover(full)
+        if mss is None or mss == self.mss or self.path is None:
+            return
+        log('路径 MTU 发生了变化，MSS 从 ' + str(self.mss) + ' 调整为 ' + str(mss))
+        self.mss = mss
+        # 更新分段的版本号，接收方会丢弃旧版本的数据包，因此需要从窗口的起点开始重新发送
         self.ack += 1
-        return ret_ack
+        self.seq = self.s_beg
+        tail = self.segment(self.data.remaining(self.s_beg))
+        self.data = spliced(self.data, self.s_beg, tail)
+        self.max = len(self.data)
+        self.high = min(self.high, self.s_beg)
 
-    def send(self, message: str):
-        self.sock.sendto(marshal.dumps(
-            packet(self.next_ack, self.next_seq, message).to_dict()), self.server)
+    def close(self):
+        """
+            发送 FIN 报文并等待 FIN-ACK，收到后即可立即开始下一次传输
+        """
+        if self.request(FIN, b'', FIN | ACK) is None:
+            log('未收到接收方的 FIN-ACK，连接已被强制关闭')
+        else:
+            log('连接已关闭')
 
     def start_send(self):
-        while self.s_beg < self.max and self.s_beg <= self.s_end:
-            # 监听重传通知事件，并在需要时处理它
-            if GLOBAL_EVENT.is_set():
-                print('已经收到接收方的重传请求，即将重传 seq 为 ' +
-                      str(RETRANSFER_SEQ) + ' 的数据包')
-                self.s_beg = RETRANSFER_SEQ
-                GLOBAL_EVENT.clear()
-            print('正在发送 seq 为 ' + str(self.s_beg) + ' 的数据包')
-            self.send(self.data[self.s_beg])
-            self.s_beg += 1
+        """
+            发送窗口内的数据包，然后等待接收方的反馈：ACK 使窗口向前滑动，NAK 使发送方立即回退到缺失的数据包，
+            超时则回退到窗口的起点。全部数据包都被确认时返回 True，接收方长时间没有响应时返回 False
+        """
+        timeouts = 0
+        while self.s_beg < self.max:
+            if self.pmtu and time.monotonic() >= self.reprobe_at:
+                self.reprobe()
+                continue
+            while self.seq < min(self.s_beg + self.window_size, self.max):
+                log('正在发送 seq 为 ' + str(self.seq) + ' 的数据包')
+                self.send(self.seq)
+                self.seq += 1
             try:
-                buf, _ = self.sock.recvfrom(1024)
-                retransfer_message: packet = marshal.loads(buf)
-                print('如果能够从 server socket 直接使用 UDP 与 client server 通信，那么控制流会到达此处 ' +
-                      str(retransfer_message.seq))
-            except:
-                pass
-            self.s_end += 1
+                buf, _ = self.sock.recvfrom(BUFFER_SIZE)
+            except socket.timeout:
+                timeouts += 1
+                if timeouts >= MAX_TIMEOUTS:
+                    log('接收方连续 ' + str(timeouts) + ' 次没有响应，放弃本次会话')
+                    return False
+                if self.pmtu and timeouts == BLACKHOLE_TIMEOUTS:
+                    # 连续超时可能是路径 MTU 变小导致的黑洞，此时完整地重新查找
+                    self.reprobe(full=True)
+                log('等待确认超时，即将从 seq 为 ' + str(self.s_beg) + ' 的数据包开始重传')
+                self.seq = self.s_beg
+                continue
+            try:
+                reply = packet.decode(buf)
+            except MALFORMED:
+                continue
+            timeouts = 0
+            self.slide(reply)
+            if not isinstance(self.data, list):
+                # 已确认的数据包不会再被发送，释放它们占用的内存，FEC 计算校验包时还需要当前组的全部数据包
+                self.data.discard(self.s_beg - self.s_beg % self.fec[0] if self.fec else self.s_beg)
+        return True
+
+    def slide(self, reply: packet):
+        """
+            根据接收方的 ACK 或 NAK 移动窗口的起点，并决定下一个要发送的序号
+        """
+        if reply.flag not in (ACK, NAK) or reply.ack < self.s_beg:
+            return
+        # NAK 同样意味着缺失序号之前的数据包都已送达
+        self.s_beg = reply.ack
+        if reply.flag == NAK:
+            log('已经收到接收方的 NAK，即将重传 seq 为 ' + str(reply.ack) +
+                ' 到 ' + str(reply.data - 1) + ' 的数据包')
+            self.seq = reply.ack
+        else:
+            self.seq = max(self.seq, self.s_beg)
+
+    def transfer(self):
+        self.completed = False
+        if not self.connect():
+            return False
+        self.completed = self.start_send()
+        if self.completed:
+            self.close()
+        return self.completed
+
+    def load(self, path: str, beg: int, end: int, size: int, name: str = None):
+        """
+            把文件的 [beg, end) 区间作为本次会话要发送的数据，name 为告诉接收方的文件名
+        """
+        self.data = chunks(path, [(beg, end)], MSS)
+        self.max = len(self.data)
+        self.s_beg = self.ack = self.seq = 0
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.offset = beg
+        self.end = end
+        self.size = size
+        stat = os.stat(path)
+        self.source = str(stat.st_size) + ':' + str(stat.st_mtime_ns)
+
+    def load_compressed(self, raw: bytes):
+        """
+            把读入的数据经过压缩阶段后追加到待发送的数据列表中
+        """
+        compressor = compress.Compressor(MSS, *self.compress)
+        for off, size, payload in compressor.pack(lambda off, size: raw[off:off + size], 0, len(raw)):
+            if payload is not None:
+                self.compressed.add(len(self.data))
+            self.data.append(raw[off:off + size] if payload is None else payload)
 
     def client_start(self):
         while True:
@@ -183,13 +1149,26 @@ class client:
             elif message == 'send':
                 if len(self.data) > 0:
                     print()
-                    self.start_send()
+                    self.transfer()
                 else:
                     print('\n还未输入需要发送的文件名，请先输入一个文件路径（相对或绝对路径均可）')
+            elif message.startswith('stripe '):
+                args = message.split()
+                if len(args) == 4 and args[1].isdigit() and os.path.isfile(args[2].strip('"')):
+                    # 并行会话使用 PORT 之后的端口，与本模拟器自身的会话互不干扰
+                    streams = int(args[1])
+                    stop = Event()
+                    receiver = stripe_receive(args[3].strip('"'), streams, stop, (IP, PORT + 1))
+                    clients = stripe_send(args[2].strip('"'), streams, (IP, PORT + 1))
+                    if not all(client_ins.completed for client_ins in clients):
+                        stop.set()
+                    receiver.join()
+                else:
+                    print('\n用法：stripe 并行会话数 源文件 输出文件')
             elif message == 'clear':
                 self.s_beg = self.ack = self.seq = 0
-                self.s_end = 0 + WINDOW_SIZE
                 self.data.clear()
+                self.compressed.clear()
                 print('已恢复程序初始状态')
             else:
                 file_name = message.strip('"')
@@ -197,12 +1176,15 @@ class client:
                 f_len = len(f_list)
                 if f_len == 1:
                     print('\n您输入了一个文件名，正在读取文件 ' + file_name + ' 中的内容: ')
-                    with open(file_name) as file:
-                        while True:
-                            current_data = file.read(500)
-                            if len(current_data) <= 0:
-                                break
-                            self.data.append(current_data)
+                    with open(f_list[0]) as file:
+                        if self.compress:
+                            self.load_compressed(file.read().encode())
+                        else:
+                            while True:
+                                current_data = file.read(MSS)
+                                if len(current_data) <= 0:
+                                    break
+                                self.data.append(current_data.encode())
                     self.max = len(self.data)
                     print('文件读取成功')
                 elif f_len > 1:
@@ -214,13 +1196,241 @@ class client:
                     print(message + ' 既不是正确的文件名，也不是本模拟器的内置命令，请您重新输入')
 
 
-def main():
+def split_ranges(size: int, streams: int) -> list:
+    """
+        把大小为 size 的文件尽量均匀地切分成 streams 个互不重叠的字节区间
+    """
+    step = -(-size // streams)
+    return [(beg, min(beg + step, size)) for beg in range(0, size, step)] if size else [(0, 0)]
+
+
+def stripe_send(path: str, streams: int, addr=(IP, PORT), name: str = None) -> list:
+    """
+        把文件切分成 streams 个字节区间，第 i 个区间由一个独立的发送方发往 addr 的端口加 i，
+        所有会话结束后返回这些发送方，可以从中读取每个会话是否成功以及统计信息
+    """
+    size = os.path.getsize(path)
+    event = Event()
+    clients = []
+    for index, (beg, end) in enumerate(split_ranges(size, streams)):
+        client_ins = client((addr[0], addr[1] + index), event)
+        client_ins.load(path, beg, end, size, name)
+        clients.append(client_ins)
+    threads = [Thread(target=client_ins.transfer) for client_ins in clients]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for client_ins in clients:
+        client_ins.sock.close()
+        client_ins.data.close()
+    log('多会话并行传输完成，共 ' + str(len(threads)) + ' 个会话，' + str(size) + ' 字节，耗时 ' +
+        str(round(time.monotonic() - start, 3)) + ' 秒')
+    return clients
+
+
+def stripe_receive(path: str, streams: int, event: Event, addr=(IP, PORT)) -> Thread:
+    """
+        在 addr 的端口到端口加 streams - 1 上各启动一个接收方，共用一个组装器写入输出文件。
+        返回的线程在所有会话都结束或 event 被设置后退出
+    """
+    output = storage(path)
+    servers = [server((addr[0], addr[1] + index), event, output) for index in range(streams)]
+    threads = [Thread(target=server_ins.server_start) for server_ins in servers]
+
+    def wait():
+        # 某个接收方的线程异常退出时它的会话无法再结束，不必继续等待
+        while not event.is_set() and not all(server_ins.finished.is_set() for server_ins in servers) \
+                and all(thread.is_alive() for thread in threads):
+            event.wait(HANDSHAKE_TIMEOUT)
+        event.set()
+        for thread in threads:
+            thread.join()
+
+    for thread in threads:
+        thread.start()
+    waiter = Thread(target=wait)
+    waiter.start()
+    return waiter
+
+
+def report(title: str, stats: dict, as_json: bool):
+    """
+        输出传输报告，as_json 为 True 时输出一行 JSON，便于脚本解析
+    """
+    duration = stats.pop('duration')
+    stats = dict(stats, duration=round(duration, 3),
+                 goodput=round(stats['bytes'] / duration, 1) if duration > 0 else 0.0)
+    if as_json:
+        print(json.dumps(stats))
+        return
+    names = {'files': '文件数', 'failed': '失败数', 'bytes': '字节数', 'wire_bytes': '发送的数据字节数（含重传）',
+             'duration': '耗时（秒）',
+             'goodput': '有效吞吐量（字节/秒）', 'packets': '发送的数据包数', 'retransmits': '重传的数据包数',
+             'mss': '最终使用的 MSS'}
+    print(title + '报告：')
+    for key, value in stats.items():
+        print('  ' + names[key] + '：' + str(value))
+
+
+def run_send(args) -> int:
+    paths = []
+    for pattern in args.files:
+        matched = [pattern] if pattern == '-' else sorted(p for p in glob.glob(pattern) if os.path.isfile(p))
+        if not matched:
+            print(pattern + ' 没有匹配到任何文件', file=sys.stderr)
+            return EXIT_USAGE
+        paths.extend(matched)
+    stats = {'files': 0, 'failed': 0, 'bytes': 0, 'wire_bytes': 0, 'packets': 0, 'retransmits': 0, 'mss': 0}
+    start = time.monotonic()
+    for path in paths:
+        name = None
+        if path == '-':
+            # 标准输入只能读取一次，先写入临时文件，以便重传时能够再次读取
+            with tempfile.NamedTemporaryFile(delete=False) as file:
+                file.write(sys.stdin.buffer.read())
+            path, name = file.name, 'stdin'
+        try:
+            clients = stripe_send(path, args.streams, (args.host, args.port), name)
+        finally:
+            if name == 'stdin':
+                os.remove(path)
+        stats['files'] += 1
+        if not all(client_ins.completed for client_ins in clients):
+            stats['failed'] += 1
+        for client_ins in clients:
+            stats['bytes'] += client_ins.bytes if client_ins.completed else 0
+            stats['wire_bytes'] += client_ins.wire
+            stats['mss'] = max(stats['mss'], client_ins.mss)
+            stats['packets'] += client_ins.sent
+            stats['retransmits'] += client_ins.retransmits
+    stats['duration'] = time.monotonic() - start
+    report('发送', stats, args.json)
+    return EXIT_OK if stats['failed'] == 0 else EXIT_FAILED
+
+
+def run_recv(args) -> int:
+    event = Event()
+    output = storage(args.output)
+    servers = [server((args.host, args.port + index), event, output) for index in range(args.streams)]
+    threads = [Thread(target=server_ins.server_start) for server_ins in servers]
+    # 输出到目录时默认一直运行，直到被中断；输出到单个文件时收完该文件即退出
+    count = args.count if args.count is not None else (None if os.path.isdir(args.output) else 1)
+    for thread in threads:
+        thread.start()
+    crashed = False
+    try:
+        # 被拒绝的文件不会再到达，同样计入收到的文件数
+        while count is None or output.completed + len(output.rejected) < count:
+            # 接收方的线程异常退出后，它负责的端口不再有人接收，继续等待只会一直挂起
+            if not all(thread.is_alive() for thread in threads):
+                print('接收方的线程异常退出，放弃接收', file=sys.stderr)
+                crashed = True
+                break
+            event.wait(HANDSHAKE_TIMEOUT)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        event.set()
+        for thread in threads:
+            thread.join()
+    started = [server_ins.started for server_ins in servers if server_ins.started is not None]
+    ended = [server_ins.ended for server_ins in servers if server_ins.ended is not None]
+    stats = {'files': output.completed, 'failed': len(output.rejected),
+             'bytes': sum(server_ins.received for server_ins in servers),
+             'duration': max(ended) - min(started) if started and ended else 0.0}
+    report('接收', stats, args.json)
+    # 没有指定文件数时一直运行到被中断为止，此时被中断属于正常退出
+    if crashed:
+        return EXIT_FAILED
+    return EXIT_OK if count is None or output.completed >= count else EXIT_FAILED
+
+
+def instrument(prof: profiler.Profiler):
+    """
+        把发送和接收流程中的各个环节替换为计时的版本，socket.recvfrom 的耗时中包含了等待数据到达的时间
+    """
+    stages = (
+        ('packet.to_dict', packet, 'to_dict'),
+        ('packet.encode', packet, 'encode'),
+        ('packet.from_dict', packet, 'from_dict'),
+        ('packet.decode', packet, 'decode'),
+        ('socket.sendto', socket.socket, 'sendto'),
+        ('socket.recvfrom', socket.socket, 'recvfrom'),
+        ('client.slide', client, 'slide'),
+        ('server.receive_data', server, 'receive_data'),
+        ('server.deliver', server, 'deliver'),
+        ('assembler.write', assembler, 'write'),
+        ('fec.encode', fec, 'encode'),
+        ('compressor.fit', compress.Compressor, 'fit'),
+        ('client.discover', client, 'discover'),
+        ('compress.decompress', compress, 'decompress'),
+        ('log', sys.modules[__name__], 'log'),
+    )
+    for stage, owner, name in stages:
+        prof.instrument(owner, name, stage)
+
+
+def fec_option(text: str) -> tuple:
+    try:
+        k, r = (int(value) for value in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError('格式应为 k,r，例如 4,1')
+    if k < 1 or r < 1:
+        raise argparse.ArgumentTypeError('k 和 r 都必须是正整数')
+    return k, r
+
+
+def positive_int(text: str) -> int:
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(text + ' 不是整数')
+    if value < 1:
+        raise argparse.ArgumentTypeError('必须是正整数')
+    return value
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='gbn_main.py', description='GBN 协议模拟器，不带参数运行时进入交互模式')
+    commands = parser.add_subparsers(dest='command')
+    send = commands.add_parser('send', help='作为发送方发送文件')
+    send.add_argument('files', nargs='+', help='要发送的文件，可以使用通配符，- 表示从标准输入读取')
+    send.add_argument('--timeout', type=float, default=TIMEOUT, help='等待 ACK 或 NAK 的超时时间（秒）')
+    send.add_argument('--fec', type=fec_option, default=FEC, help='前向纠错参数 k,r，默认不启用')
+    send.add_argument('--compress', type=int, nargs='?', const=6, choices=range(10), metavar='LEVEL',
+                      help='压缩数据，LEVEL 为 0 到 9 的压缩级别，省略时为 6，默认不压缩')
+    send.add_argument('--codec', default='zlib', choices=sorted(compress.CODECS), help='压缩使用的编码')
+    send.add_argument('--mss', type=positive_int, default=MSS, help='每个数据包携带的最大字节数，探测路径 MTU 时为探测失败后使用的值')
+    send.add_argument('--pmtu', action='store_true', help='探测路径 MTU，使用不会被分片的最大 MSS')
+    send.add_argument('--reprobe', type=float, default=REPROBE_INTERVAL, help='重新探测路径 MTU 的间隔（秒）')
+    recv = commands.add_parser('recv', help='作为接收方接收文件')
+    recv.add_argument('output', help='输出文件；若为已存在的目录，则按发送方的文件名保存在该目录下')
+    recv.add_argument('--loss', type=float, default=LOST_POSSIBILITY, help='模拟的丢包率')
+    recv.add_argument('--count', type=positive_int, help='收完多少个文件后退出，输出到单个文件时默认为 1')
+    recv.add_argument('--mss', type=positive_int, default=pmtu.MAX_DATAGRAM, help='允许发送方使用的最大 MSS')
+    for sub in (send, recv):
+        sub.add_argument('--host', default=IP, help='接收方的地址')
+        sub.add_argument('--port', type=int, default=PORT, help='接收方的起始端口，第 i 个并行会话使用端口加 i')
+        sub.add_argument('--streams', type=positive_int, default=1, help='并行会话数')
+        sub.add_argument('--window', type=positive_int, default=WINDOW_SIZE, help='窗口大小')
+        sub.add_argument('-q', '--quiet', action='store_true', help='只输出最终的传输报告')
+        sub.add_argument('--json', action='store_true', help='以 JSON 格式输出传输报告')
+        sub.add_argument('--stages', nargs='?', const='', metavar='FILE',
+                         help='按阶段统计耗时，结束时（以及收到 SIGUSR1 时）输出到 FILE，默认输出到标准错误')
+        sub.add_argument('--cprofile', metavar='FILE', help='在 cProfile 下运行，并把统计结果写入 FILE')
+    return parser.parse_args(argv)
+
+
+def interactive():
     print('欢迎使用 GBN 协议模拟器！')
     print('您可以输入需要执行的指令：\n'
           '1. 输入 exit 可退出本模拟器\n'
           '2. 输入 send 可发送已读取的数据\n'
           '3. 输入 clear 可将程序恢复至初始状态\n'
-          '4. 输入一个无歧义的文件名（可使用通配符，相对路径或绝对路径均可），可以读取对应的文件中的数据')
+          '4. 输入一个无歧义的文件名（可使用通配符，相对路径或绝对路径均可），可以读取对应的文件中的数据\n'
+          '5. 输入 stripe 并行会话数 源文件 输出文件，可以进行多会话并行传输')
     event = Event()
     server_ins = server((IP, PORT), event)
     client_ins = client((IP, PORT), event)
@@ -228,5 +1438,42 @@ def main():
     Thread(target=client_ins.client_start).start()
 
 
+def main(argv=None) -> int:
+    global WINDOW_SIZE, MSS, TIMEOUT, LOST_POSSIBILITY, FEC, COMPRESS, PMTU, REPROBE_INTERVAL, VERBOSE
+    args = parse_args(argv)
+    if args.command is None:
+        interactive()
+        return EXIT_OK
+    WINDOW_SIZE = args.window
+    MSS = args.mss
+    VERBOSE = not args.quiet
+    if args.command == 'send':
+        TIMEOUT = args.timeout
+        FEC = args.fec
+        COMPRESS = (args.codec, args.compress) if args.compress is not None else None
+        PMTU = args.pmtu
+        REPROBE_INTERVAL = args.reprobe
+        run = run_send
+    else:
+        LOST_POSSIBILITY = args.loss
+        run = run_recv
+    # 把 SIGTERM 当作中断处理，以便在后台运行的接收方被终止时也能输出报告
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    prof = None
+    if args.stages is not None:
+        prof = profiler.Profiler()
+        instrument(prof)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: prof.dump(args.stages or None))
+    try:
+        if args.cprofile:
+            return profiler.run_cprofile(run, args.cprofile, args)
+        return run(args)
+    finally:
+        if prof is not None:
+            prof.restore()
+            prof.dump(args.stages or None)
+
+
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+    路径 MTU 探测模块
+    发送方在设置了 DF（不分片）标志的套接字上发送逐渐增大的探测报文，接收方对每个收到的探测报文回复其长度，
+    按常见链路的 MTU 逐级向上尝试，再在第一个失败的平台之下二分查找出能够得到回复的最大报文长度，
+    从而选出不会被分片的最大 MSS。
+    Linux 上通过 IP_MTU_DISCOVER 设置 DF 标志，其他平台上无法禁止分片，只能探测出直接丢弃大报文的路径。
+    本模块还提供一个可以限制 MTU 并增加时延的本地 UDP 中继，用于在回环地址上模拟 MTU 较小或往返时间较长的路径：
+    python pmtu.py 监听端口 目标端口 --mtu 1500 --delay 0.1
+"""
+import argparse
+import heapq
+import select
+import socket
+import sys
+import time
+from threading import Thread, Event
+
+# IPv4 首部与 UDP 首部的长度之和
+UDP_OVERHEAD = 28
+# IPv4 主机必须能够接收的最小报文长度为 576 字节，去掉首部后即为最小的探测长度
+MIN_DATAGRAM = 576 - UDP_OVERHEAD
+# 一个 UDP 报文最多能携带的数据
+MAX_DATAGRAM = 65535 - UDP_OVERHEAD
+# 二分查找停止时的精度（字节）
+GRANULE = 16
+# 常见链路的 MTU，取自 RFC 1191 的 MTU 平台表，另外加上以太网的 1500 和巨型帧的 9000。
+# 重新探测时只尝试比当前高一级的平台，路径没有变化时不必重新二分查找
+PLATEAUS = (1006, 1280, 1492, 1500, 2002, 4352, 8166, 9000, 17914, 32000, 65535)
+
+# 较早的 Python 版本没有导出这些常量，在 Linux 上使用它们在内核头文件中的取值
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10 if sys.platform.startswith('linux') else None)
+# 设置 DF 标志，并且不受内核缓存的路径 MTU 的限制，适合用来探测
+IP_PMTUDISC_PROBE = getattr(socket, 'IP_PMTUDISC_PROBE', 3)
+
+
+def set_dont_fragment(sock: socket.socket) -> bool:
+    """
+        为套接字设置 DF 标志，平台不支持时返回 False
+    """
+    if IP_MTU_DISCOVER is None:
+        return False
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+    except OSError:
+        return False
+    return True
+
+
+def search(attempt, low: int, high: int, granule: int = GRANULE):
+    """
+        查找 [low, high] 中 attempt(size) 为 True 的最大的 size，精度为 granule 字节，low 也失败时返回 None。
+        失败的探测需要等到超时，成功的只需要一个往返时间，因此从 low 开始按平台逐级向上尝试，
+        遇到第一个失败的平台后再在它与上一个平台之间二分查找，失败的次数比在整个范围内二分查找少得多
+    """
+    if not attempt(low):
+        return None
+    while low < high:
+        size = next_plateau(low, high)
+        if not attempt(size):
+            high = size
+            break
+        low = size
+    # 实际的路径 MTU 通常恰好是某个平台，先确认比上一个平台再大一点是否已经失败，是则不必二分查找
+    if high - low > granule and not attempt(low + granule):
+        return low
+    while high - low > granule:
+        size = (low + high) // 2
+        if attempt(size):
+            low = size
+        else:
+            high = size
+    return low
+
+
+def next_plateau(size: int, high: int) -> int:
+    """
+        返回比 size 大的下一个平台对应的报文长度，不超过 high
+    """
+    for mtu in PLATEAUS:
+        if mtu - UDP_OVERHEAD > size:
+            return min(mtu - UDP_OVERHEAD, high)
+    return high
+
+
+class Relay:
+    """
+        本地 UDP 中继：把发往 listen 的报文转发给 target，并把 target 的回复转发给最近一个发送方，
+        长度超过 mtu 的报文（包括 IP 和 UDP 首部）会被直接丢弃，mtu 可以在运行时修改以模拟路径的变化。
+        每个方向的报文都延迟 delay 秒后再转发，往返时间因此增加 2 * delay
+    """
+
+    def __init__(self, listen, target, mtu: int, delay: float = 0.0) -> None:
+        self.front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.front.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.front.bind(listen)
+        self.back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.back.bind((listen[0], 0))
+        self.target = target
+        self.mtu = mtu
+        self.delay = delay
+        # 等待转发的报文：(转发时间, 编号, 套接字, 报文, 目的地址)
+        self.queue = []
+        self.count = 0
+        self.peer = None
+        self.dropped = 0
+        self.forwarded = 0
+        self.event = Event()
+        self.thread = Thread(target=self.run)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.event.set()
+        self.thread.join()
+        self.front.close()
+        self.back.close()
+
+    def run(self):
+        while not self.event.is_set():
+            now = time.monotonic()
+            while self.queue and self.queue[0][0] <= now:
+                _, _, out, buf, dest = heapq.heappop(self.queue)
+                out.sendto(buf, dest)
+            wait = min(0.1, self.queue[0][0] - now) if self.queue else 0.1
+            readable, _, _ = select.select([self.front, self.back], [], [], wait)
+            for sock in readable:
+                buf, addr = sock.recvfrom(MAX_DATAGRAM)
+                if sock is self.front:
+                    self.peer = addr
+                    dest, out = self.target, self.back
+                elif self.peer is not None:
+                    dest, out = self.peer, self.front
+                else:
+                    continue
+                if len(buf) + UDP_OVERHEAD > self.mtu:
+                    self.dropped += 1
+                    continue
+                self.forwarded += 1
+                if self.delay > 0:
+                    self.count += 1
+                    heapq.heappush(self.queue, (time.monotonic() + self.delay, self.count, out, buf, dest))
+                else:
+                    out.sendto(buf, dest)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='pmtu.py', description='限制 MTU 的本地 UDP 中继')
+    parser.add_argument('listen', type=int, help='中继监听的端口')
+    parser.add_argument('target', type=int, help='转发的目标端口')
+    parser.add_argument('--host', default='127.0.0.1', help='监听和转发的地址')
+    parser.add_argument('--mtu', type=int, default=1500, help='允许通过的最大报文长度，包括 IP 和 UDP 首部')
+    parser.add_argument('--delay', type=float, default=0.0, help='每个方向的报文转发前延迟的时间（秒）')
+    parser.add_argument('--streams', type=int, default=1, help='并行会话数，第 i 个中继监听端口加 i，转发到目标端口加 i')
+    args = parser.parse_args(argv)
+    relays = [Relay((args.host, args.listen + i), (args.host, args.target + i), args.mtu, args.delay).start()
+              for i in range(args.streams)]
+    print('中继已启动，MTU 为 ' + str(args.mtu) + '，按 Ctrl+C 退出')
+    try:
+        while True:
+            relays[0].event.wait(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for relay in relays:
+            relay.stop()
+        print('已转发 ' + str(sum(relay.forwarded for relay in relays)) + ' 个报文，丢弃 ' +
+              str(sum(relay.dropped for relay in relays)) + ' 个超过 MTU 的报文')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+    性能分析模块
+    按阶段统计发送和接收流程中各个环节的耗时：instrument 把对象上的某个方法替换为计时的版本，
+    每次调用的耗时（perf_counter_ns）都会记录到该阶段的直方图中，restore 则把它们全部还原。
+    计时只在调用 instrument 之后才存在，未启用时热路径上没有任何额外的开销。
+    各阶段的耗时是包含关系，例如 packet.encode 的耗时中包含了 packet.to_dict 的耗时。
+    此外 run_cprofile 可以把一次运行（包括其间启动的线程）置于 cProfile 之下，并把统计结果写入文件。
+"""
+import cProfile
+import inspect
+import pstats
+import sys
+import threading
+import time
+
+# 每个 2 的幂次区间再细分为 2 ** SUB_BITS 个桶，分位数的相对误差不超过 1 / 2 ** SUB_BITS
+SUB_BITS = 3
+
+
+class Histogram:
+    """
+        以纳秒为单位的对数直方图，记录调用次数、总耗时、最小值和最大值，并可以估计分位数
+    """
+
+    def __init__(self) -> None:
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def add(self, ns: int):
+        self.count += 1
+        self.total += ns
+        self.min = ns if self.min is None else min(self.min, ns)
+        self.max = max(self.max, ns)
+        index = bucket(ns)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def percentile(self, p: float) -> int:
+        """
+            返回第 p 百分位数所在桶的上界
+        """
+        if self.count == 0:
+            return 0
+        rank = p / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(upper(index), self.max)
+        return self.max
+
+
+def bucket(ns: int) -> int:
+    exp = ns.bit_length() - 1
+    if exp < SUB_BITS:
+        return ns
+    return ((exp - SUB_BITS + 1) << SUB_BITS) | ((ns >> (exp - SUB_BITS)) & ((1 << SUB_BITS) - 1))
+
+
+def upper(index: int) -> int:
+    """
+        返回 bucket 编号为 index 的桶中最大的取值
+    """
+    exp = (index >> SUB_BITS) + SUB_BITS - 1
+    if exp < SUB_BITS:
+        return index
+    low = (1 << exp) | ((index & ((1 << SUB_BITS) - 1)) << (exp - SUB_BITS))
+    return low + (1 << (exp - SUB_BITS)) - 1
+
+
+class Profiler:
+    """
+        各阶段耗时的汇总，多个线程可以同时记录
+    """
+
+    def __init__(self) -> None:
+        self.stages = {}
+        self.lock = threading.Lock()
+        # 被替换的方法：(对象, 属性名, 原来的属性值)，原来的属性值为 None 表示它是从父类继承的
+        self.patched = []
+
+    def record(self, stage: str, ns: int):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].add(ns)
+
+    def timed(self, stage: str, func):
+        record = self.record
+        clock = time.perf_counter_ns
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(stage, clock() - start)
+
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def instrument(self, owner, name: str, stage: str = None):
+        """
+            把 owner（类或模块）上名为 name 的函数替换为计时的版本，stage 默认为 owner.name
+        """
+        if stage is None:
+            stage = getattr(owner, '__name__', type(owner).__name__) + '.' + name
+        original = inspect.getattr_static(owner, name)
+        if isinstance(original, staticmethod):
+            replacement = staticmethod(self.timed(stage, original.__func__))
+        else:
+            replacement = self.timed(stage, getattr(owner, name))
+        self.patched.append((owner, name, vars(owner).get(name)))
+        setattr(owner, name, replacement)
+
+    def restore(self):
+        while self.patched:
+            owner, name, original = self.patched.pop()
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+
+    def report(self) -> str:
+        """
+            按总耗时从大到小输出各阶段的调用次数、总耗时和耗时分布（微秒）
+        """
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1].total, reverse=True)
+        lines = ['%-22s %9s %11s %9s %9s %9s %9s' %
+                 ('stage', 'calls', 'total(ms)', 'mean(us)', 'p50(us)', 'p99(us)', 'max(us)')]
+        for stage, hist in stages:
+            lines.append('%-22s %9d %11.2f %9.1f %9.1f %9.1f %9.1f' % (
+                stage, hist.count, hist.total / 1e6, hist.total / hist.count / 1e3,
+                hist.percentile(50) / 1e3, hist.percentile(99) / 1e3, hist.max / 1e3))
+        return '\n'.join(lines)
+
+    def dump(self, path: str = None):
+        """
+            把报告追加到文件 path 中，path 为 None 时输出到标准错误
+        """
+        text = self.report() + '\n\n'
+        if path is None:
+            sys.stderr.write(text)
+        else:
+            with open(path, 'a') as file:
+                file.write(text)
+
+
+def run_cprofile(func, path: str, *args, **kwargs):
+    """
+        在 cProfile 下运行 func 并把统计结果写入 path，可以用 python -m pstats path 查看。
+        cProfile 只能统计启用它的线程，因此运行期间新启动的线程各自使用一个 Profile，结束后合并到一起
+    """
+    profiles = [cProfile.Profile()]
+    run = threading.Thread.run
+
+    def profiled_run(thread):
+        prof = cProfile.Profile()
+        profiles.append(prof)
+        prof.runcall(run, thread)
+
+    threading.Thread.run = profiled_run
+    try:
+        return profiles[0].runcall(func, *args, **kwargs)
+    finally:
+        threading.Thread.run = run
+        stats = pstats.Stats(profiles[0])
+        for prof in profiles[1:]:
+            stats.add(prof)
+        stats.dump_stats(path)
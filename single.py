@@ -5,27 +5,47 @@ from dataclasses import dataclass
 import time
 import random
 
+import fec
+
 IP = '127.0.0.1'
 PORT = 4567
 WINDOW_SIZE = 4
 TIMEOUT = 2
+# 本次模拟总共发送的数据包个数
+TOTAL = 20
+# 前向纠错参数 (k, r)：每 k 个数据包追加 r 个校验包，为 None 时不启用
+FEC = None
+# 握手与挥手阶段等待应答的时间和最大重试次数
+HANDSHAKE_TIMEOUT = 0.2
+HANDSHAKE_RETRY = 5
+# 回复 FIN-ACK 后的逗留时间，需要大于 HANDSHAKE_TIMEOUT
+LINGER = 0.5
+
+# 报文首部的标志位，SYN | ACK 即为 SYN-ACK 报文
+DATA = 0
+SYN = 1
+ACK = 2
+FIN = 4
+PARITY = 16
 
 @dataclass
 class Packet:
     ack: int
     seq: int
     data: str
+    flag: int = DATA
 
     def to_dict(self):
         return {
             'ack': self.ack,
             'seq': self.seq,
-            'data': self.data
+            'data': self.data,
+            'flag': self.flag
         }
 
     @staticmethod
     def from_dict(dict: dict):
-        return Packet(dict['ack'], dict['seq'], dict['data'])
+        return Packet(dict['ack'], dict['seq'], dict['data'], dict.get('flag', DATA))
 
 
 class Server:
@@ -39,6 +59,8 @@ class Server:
         self.packets = []
         self.ack_received = [False] * 100
         self.event = Event()
+        self.client_addr = None
+        self.closed = Event()
 
     def send_packet(self, packet, client_addr):
         if random.random() > 0.1:  # 模拟丢包，90%的概率发送成功
@@ -47,28 +69,74 @@ class Server:
         else:
             print(f"丢失: {packet}")
 
+    def send_control(self, flag, data=''):
+        packet = Packet(ack=0, seq=self.nextseqnum, data=data, flag=flag)
+        self.sock.sendto(marshal.dumps(packet.to_dict()), self.client_addr)
+
+    def accept(self):
+        # 等待客户端的 SYN，记录客户端地址后回复 SYN-ACK，告知本方的窗口大小
+        while True:
+            try:
+                buf, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            packet = Packet.from_dict(marshal.loads(buf))
+            if packet.flag & SYN:
+                self.client_addr = addr
+                self.send_control(SYN | ACK, {'window': WINDOW_SIZE, 'fec': FEC})
+                print(f"与客户端 {addr} 建立连接")
+                return
+
+    def close(self):
+        # 数据全部被确认后发送 FIN，收到 FIN-ACK 后结束，超时则重传 FIN
+        for _ in range(HANDSHAKE_RETRY):
+            self.send_control(FIN)
+            print("发送FIN")
+            if self.closed.wait(HANDSHAKE_TIMEOUT):
+                print("连接已关闭")
+                return
+        self.closed.set()
+        print("未收到FIN-ACK，强制关闭连接")
+
     def server_start(self):
+        self.accept()
         Thread(target=self.receive_ack).start()
-        client_addr = None
+        client_addr = self.client_addr
         while True:
-            while self.nextseqnum < self.base + WINDOW_SIZE:
+            while self.nextseqnum < min(self.base + WINDOW_SIZE, TOTAL):
                 data = f"消息 {self.nextseqnum}"
                 packet = Packet(ack=0, seq=self.nextseqnum, data=data)
                 self.packets.append(packet)
-                client_addr = (IP, PORT)
                 self.send_packet(packet, client_addr)
                 self.nextseqnum += 1
+                if FEC is not None and (self.nextseqnum % FEC[0] == 0 or self.nextseqnum == TOTAL):
+                    self.send_parity((self.nextseqnum - 1) // FEC[0])
                 time.sleep(1)
             self.event.wait(TIMEOUT)
-            if self.base == self.nextseqnum:
+            if self.base == TOTAL:
                 break
             self.event.clear()
+        self.close()
+
+    def send_parity(self, group):
+        # 一组数据包发送完毕后发送它的校验包，校验包的 seq 为组号，ack 为组内的校验下标
+        k, r = FEC
+        blocks = [packet.data.encode() for packet in self.packets[group * k:(group + 1) * k]]
+        for index, payload in enumerate(fec.encode(blocks, r)):
+            self.send_packet(Packet(ack=index, seq=group, data=payload, flag=PARITY), self.client_addr)
 
     def receive_ack(self):
-        while True:
+        while not self.closed.is_set():
             try:
                 buf, _ = self.sock.recvfrom(1024)
                 ack_packet = Packet.from_dict(marshal.loads(buf))
+                if ack_packet.flag == FIN | ACK:
+                    self.closed.set()
+                    break
+                if ack_packet.flag & SYN:
+                    # SYN-ACK 丢失，客户端重传了 SYN
+                    self.send_control(SYN | ACK, {'window': WINDOW_SIZE, 'fec': FEC})
+                    continue
                 print(f"收到ACK: {ack_packet}")
                 self.ack_received[ack_packet.ack] = True
                 if ack_packet.ack == self.base:
@@ -77,7 +145,7 @@ class Server:
                     self.event.set()
             except socket.timeout:
                 for i in range(self.base, self.nextseqnum):
-                    self.send_packet(self.packets[i], (IP, PORT))
+                    self.send_packet(self.packets[i], self.client_addr)
 
 class Client:
     def __init__(self, addr) -> None:
@@ -85,25 +153,109 @@ class Client:
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.settimeout(TIMEOUT)
         self.server = addr
+        self.expected_seq = 0
+        self.fec = None
+        self.groups = {}
         Thread(target=self.receive_packet).start()
 
     def send_ack(self, ack):
-        ack_packet = Packet(ack=ack, seq=0, data='')
+        ack_packet = Packet(ack=ack, seq=0, data='', flag=ACK)
         self.sock.sendto(marshal.dumps(ack_packet.to_dict()), self.server)
         print(f"发送ACK: {ack_packet}")
 
+    def send_control(self, flag):
+        packet = Packet(ack=0, seq=0, data='', flag=flag)
+        self.sock.sendto(marshal.dumps(packet.to_dict()), self.server)
+
+    def connect(self):
+        # 向服务器发送 SYN，收到 SYN-ACK 即连接建立，超时则重传 SYN
+        self.sock.settimeout(HANDSHAKE_TIMEOUT)
+        try:
+            for _ in range(HANDSHAKE_RETRY):
+                self.send_control(SYN)
+                try:
+                    buf, _ = self.sock.recvfrom(1024)
+                except socket.timeout:
+                    continue
+                reply = Packet.from_dict(marshal.loads(buf))
+                if reply.flag == SYN | ACK:
+                    self.fec = reply.data.get('fec')
+                    print("与服务器建立连接")
+                    return True
+            return False
+        finally:
+            self.sock.settimeout(TIMEOUT)
+
+    def linger(self):
+        # 回复 FIN-ACK 后逗留一段时间，若 FIN-ACK 丢失，服务器重传的 FIN 仍能得到应答
+        self.sock.settimeout(LINGER)
+        while True:
+            try:
+                buf, _ = self.sock.recvfrom(1024)
+            except socket.timeout:
+                break
+            if Packet.from_dict(marshal.loads(buf)).flag & FIN:
+                self.send_control(FIN | ACK)
+
+    def group(self, index):
+        if index not in self.groups:
+            self.groups[index] = fec.FecGroup(self.fec[1])
+        return self.groups[index]
+
+    def drain(self):
+        # 按序确认已缓存的数据包，缺少下一个数据包时先尝试用校验包恢复它，返回是否有新的数据包被确认
+        k = self.fec[0]
+        delivered = False
+        while True:
+            group, index = divmod(self.expected_seq, k)
+            if group not in self.groups:
+                break
+            blocks = self.groups[group].blocks
+            if index not in blocks:
+                for i in self.groups[group].recover():
+                    print(f"通过FEC恢复: seq={group * k + i}")
+                if index not in blocks:
+                    break
+            self.send_ack(self.expected_seq)
+            self.expected_seq += 1
+            delivered = True
+            if self.expected_seq % k == 0:
+                del self.groups[group]
+        return delivered
+
     def receive_packet(self):
-        expected_seq = 0
+        if not self.connect():
+            print("无法与服务器建立连接")
+            return
         while True:
             try:
                 buf, _ = self.sock.recvfrom(1024)
                 packet = Packet.from_dict(marshal.loads(buf))
+                if packet.flag & FIN:
+                    self.send_control(FIN | ACK)
+                    self.linger()
+                    print("服务器已关闭连接，客户端退出")
+                    break
+                if packet.flag & SYN:
+                    continue
+                if packet.flag & PARITY:
+                    if self.fec is not None and packet.seq >= self.expected_seq // self.fec[0]:
+                        self.group(packet.seq).add_parity(packet.ack, packet.data)
+                        self.drain()
+                    continue
                 print(f"收到: {packet}")
-                if packet.seq == expected_seq:
+                if self.fec is not None:
+                    # 启用 FEC 时缓存组内的乱序数据包，以便校验包恢复缺口后一并确认
+                    k = self.fec[0]
+                    if packet.seq >= self.expected_seq:
+                        self.group(packet.seq // k).add_data(packet.seq % k, packet.data.encode())
+                    if not self.drain():
+                        self.send_ack(self.expected_seq - 1)
+                elif packet.seq == self.expected_seq:
                     self.send_ack(packet.seq)
-                    expected_seq += 1
+                    self.expected_seq += 1
                 else:
-                    self.send_ack(expected_seq - 1)
+                    self.send_ack(self.expected_seq - 1)
             except socket.timeout:
                 continue
 
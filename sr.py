@@ -5,27 +5,47 @@ from dataclasses import dataclass
 import time
 import random
 
+import fec
+
 IP = '127.0.0.1'
 PORT = 4567
 WINDOW_SIZE = 4
 TIMEOUT = 2
+# 总共发送的数据包个数
+TOTAL = 5
+# 前向纠错参数 (k, r)：每 k 个数据包追加 r 个校验包，为 None 时不启用
+FEC = None
+# 握手与挥手阶段等待应答的时间和最大重试次数
+HANDSHAKE_TIMEOUT = 0.2
+HANDSHAKE_RETRY = 5
+# 回复 FIN-ACK 后的逗留时间，需要大于 HANDSHAKE_TIMEOUT
+LINGER = 0.5
+
+# 报文首部的标志位，SYN | ACK 即为 SYN-ACK 报文
+DATA = 0
+SYN = 1
+ACK = 2
+FIN = 4
+PARITY = 16
 
 @dataclass
 class Packet:
     ack: int
     seq: int
     data: str
+    flag: int = DATA
 
     def to_dict(self):
         return {
             'ack': self.ack,
             'seq': self.seq,
-            'data': self.data
+            'data': self.data,
+            'flag': self.flag
         }
 
     @staticmethod
     def from_dict(dict: dict):
-        return Packet(dict['ack'], dict['seq'], dict['data'])
+        return Packet(dict['ack'], dict['seq'], dict['data'], dict.get('flag', DATA))
 
 
 class SRServer:
@@ -41,6 +61,8 @@ class SRServer:
         self.timer = {}
         self.event = Event()
         self.finished = False
+        self.client_addr = None
+        self.closed = Event()
 
     def send_packet(self, packet, client_addr):
         if random.random() > 0.1:  # 模拟丢包，90%的概率发送成功
@@ -49,35 +71,74 @@ class SRServer:
         else:
             print(f"丢失: {packet}")
 
+    def send_control(self, flag, data=''):
+        packet = Packet(ack=0, seq=self.nextseqnum, data=data, flag=flag)
+        self.sock.sendto(marshal.dumps(packet.to_dict()), self.client_addr)
+
+    def accept(self):
+        while True:
+            try:
+                buf, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            packet = Packet.from_dict(marshal.loads(buf))
+            if packet.flag & SYN:
+                self.client_addr = addr
+                self.send_control(SYN | ACK, {'window': WINDOW_SIZE, 'fec': FEC})
+                print(f"与客户端 {addr} 建立连接")
+                return
+
+    def close(self):
+        for _ in range(HANDSHAKE_RETRY):
+            self.send_control(FIN)
+            print("发送FIN")
+            if self.closed.wait(HANDSHAKE_TIMEOUT):
+                break
+        else:
+            print("未收到FIN-ACK，强制关闭连接")
+        self.finished = True
+        self.closed.set()
+
     def server_start(self):
+        self.accept()
         Thread(target=self.receive_ack).start()
-        client_addr = (IP, PORT)
-        while not self.finished:
-            while self.nextseqnum < self.base + WINDOW_SIZE:
-                if self.nextseqnum < 5:  # 总共发送5个数据包
-                    data = f"消息 {self.nextseqnum}"
-                else:
-                    data = "END"
+        client_addr = self.client_addr
+        while True:
+            while self.nextseqnum < min(self.base + WINDOW_SIZE, TOTAL):
+                data = f"消息 {self.nextseqnum}"
                 packet = Packet(ack=0, seq=self.nextseqnum, data=data)
                 self.packets[self.nextseqnum] = packet
-                self.send_packet(packet, client_addr)
+                # 先登记计时器和序号再发送，避免 ACK 先于 nextseqnum 更新到达而被丢弃
                 self.start_timer(self.nextseqnum)
                 self.nextseqnum += 1
-                if data == "END":
-                    self.finished = True
-                    break
+                self.send_packet(packet, client_addr)
+                if FEC is not None and (self.nextseqnum % FEC[0] == 0 or self.nextseqnum == TOTAL):
+                    self.send_parity((self.nextseqnum - 1) // FEC[0])
                 time.sleep(0.5)
             self.event.wait(TIMEOUT)
-            if self.base == self.nextseqnum:
+            if self.base == TOTAL:
                 break
             self.event.clear()
+        self.close()
         print("服务器传输完成，结束连接")
 
+    def send_parity(self, group):
+        k, r = FEC
+        blocks = [self.packets[seq].data.encode() for seq in range(group * k, min((group + 1) * k, TOTAL))]
+        for index, payload in enumerate(fec.encode(blocks, r)):
+            self.send_packet(Packet(ack=index, seq=group, data=payload, flag=PARITY), self.client_addr)
+
     def receive_ack(self):
         while not self.finished:
             try:
                 buf, _ = self.sock.recvfrom(1024)
                 ack_packet = Packet.from_dict(marshal.loads(buf))
+                if ack_packet.flag == FIN | ACK:
+                    self.closed.set()
+                    break
+                if ack_packet.flag & SYN:
+                    self.send_control(SYN | ACK, {'window': WINDOW_SIZE, 'fec': FEC})
+                    continue
                 print(f"收到ACK: {ack_packet}")
                 if self.base <= ack_packet.ack < self.nextseqnum:
                     self.ack_received[ack_packet.ack] = True
@@ -87,17 +148,17 @@ class SRServer:
                             self.base += 1
                         self.event.set()
             except socket.timeout:
-                for seq in self.timer:
-                    self.send_packet(self.packets[seq], (IP, PORT))
+                for seq in list(self.timer):
+                    self.send_packet(self.packets[seq], self.client_addr)
 
     def start_timer(self, seq):
         self.timer[seq] = time.time()
         Thread(target=self.check_timeout, args=(seq,)).start()
 
     def check_timeout(self, seq):
-        while seq in self.timer:
+        while seq in self.timer and not self.finished:
             if time.time() - self.timer[seq] > TIMEOUT:
-                self.send_packet(self.packets[seq], (IP, PORT))
+                self.send_packet(self.packets[seq], self.client_addr)
                 self.timer[seq] = time.time()
             time.sleep(0.1)
 
@@ -111,38 +172,103 @@ class SRClient:
         self.expected_seq = 0
         self.received_packets = {}
         self.finished = False
-        Thread(target=self.receive_packet).start()
+        self.fec = None
+        self.groups = {}
 
     def send_ack(self, ack):
-        ack_packet = Packet(ack=ack, seq=0, data='')
+        ack_packet = Packet(ack=ack, seq=0, data='', flag=ACK)
         self.sock.sendto(marshal.dumps(ack_packet.to_dict()), self.server)
         print(f"发送ACK: {ack_packet}")
 
+    def send_control(self, flag):
+        packet = Packet(ack=0, seq=0, data='', flag=flag)
+        self.sock.sendto(marshal.dumps(packet.to_dict()), self.server)
+
+    def connect(self):
+        self.sock.settimeout(HANDSHAKE_TIMEOUT)
+        try:
+            for _ in range(HANDSHAKE_RETRY):
+                self.send_control(SYN)
+                try:
+                    buf, _ = self.sock.recvfrom(1024)
+                except socket.timeout:
+                    continue
+                reply = Packet.from_dict(marshal.loads(buf))
+                if reply.flag == SYN | ACK:
+                    self.fec = reply.data.get('fec')
+                    print("与服务器建立连接")
+                    return True
+            return False
+        finally:
+            self.sock.settimeout(TIMEOUT)
+
+    def linger(self):
+        self.sock.settimeout(LINGER)
+        while True:
+            try:
+                buf, _ = self.sock.recvfrom(1024)
+            except socket.timeout:
+                break
+            if Packet.from_dict(marshal.loads(buf)).flag & FIN:
+                self.send_control(FIN | ACK)
+
     def receive_packet(self):
+        if not self.connect():
+            print("无法与服务器建立连接")
+            return
         while not self.finished:
             try:
                 buf, _ = self.sock.recvfrom(1024)
                 packet = Packet.from_dict(marshal.loads(buf))
-                print(f"从服务器收到: {packet}")
-                if packet.data == "END":
+                if packet.flag & FIN:
+                    self.send_control(FIN | ACK)
+                    self.linger()
                     self.finished = True
                     print("客户端传输完成，结束连接")
                     break
-                if packet.seq == self.expected_seq:
-                    print(f"按序收到数据包 {packet.seq}")
-                    self.send_ack(packet.seq)
-                    self.expected_seq += 1
-                    while self.expected_seq in self.received_packets:
-                        self.expected_seq += 1
-                elif packet.seq > self.expected_seq:
-                    print(f"缓存乱序数据包 {packet.seq}")
-                    self.received_packets[packet.seq] = packet
-                    self.send_ack(packet.seq)
-                else:
-                    self.send_ack(self.expected_seq - 1)
+                if packet.flag & SYN:
+                    continue
+                if packet.flag & PARITY:
+                    if self.fec is not None:
+                        self.group(packet.seq).add_parity(packet.ack, packet.data)
+                        self.recover(packet.seq)
+                    continue
+                print(f"从服务器收到: {packet}")
+                self.handle_packet(packet)
+                if self.fec is not None:
+                    k = self.fec[0]
+                    self.group(packet.seq // k).add_data(packet.seq % k, packet.data.encode())
+                    self.recover(packet.seq // k)
             except socket.timeout:
                 continue
 
+    def group(self, index):
+        if index not in self.groups:
+            self.groups[index] = fec.FecGroup(self.fec[1])
+        return self.groups[index]
+
+    def recover(self, group):
+        k = self.fec[0]
+        for i in self.groups[group].recover():
+            packet = Packet(ack=0, seq=group * k + i, data=self.groups[group].blocks[i].decode())
+            print(f"通过FEC恢复: {packet}")
+            self.handle_packet(packet)
+
+    def handle_packet(self, packet):
+        if packet.seq == self.expected_seq:
+            print(f"按序收到数据包 {packet.seq}")
+            self.send_ack(packet.seq)
+            self.expected_seq += 1
+            while self.expected_seq in self.received_packets:
+                self.expected_seq += 1
+        elif packet.seq > self.expected_seq:
+            print(f"缓存乱序数据包 {packet.seq}")
+            self.received_packets[packet.seq] = packet
+            self.send_ack(packet.seq)
+        else:
+            # 重复的数据包说明之前的 ACK 丢失，需要针对它再次确认
+            self.send_ack(packet.seq)
+
 
 def main():
     print("欢迎使用GBN协议模拟程序")
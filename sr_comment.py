@@ -5,10 +5,26 @@ from dataclasses import dataclass
 import time
 import random
 
+import fec
+
 IP = '127.0.0.1'  # 服务器IP地址
 PORT = 4567  # 服务器端口号
 WINDOW_SIZE = 5  # 窗口大小
 TIMEOUT = 2  # 超时时间，单位秒
+TOTAL = 5  # 总共发送的数据包个数
+FEC = None  # 前向纠错参数 (k, r)：每 k 个数据包追加 r 个校验包，为 None 时不启用
+# 握手与挥手阶段等待应答的时间和最大重试次数
+HANDSHAKE_TIMEOUT = 0.2
+HANDSHAKE_RETRY = 5
+# 回复 FIN-ACK 后的逗留时间，需要大于 HANDSHAKE_TIMEOUT
+LINGER = 0.5
+
+# 报文首部的标志位，SYN | ACK 即为 SYN-ACK 报文
+DATA = 0
+SYN = 1
+ACK = 2
+FIN = 4
+PARITY = 16
 
 @dataclass
 class Packet:
@@ -19,24 +35,27 @@ class Packet:
         ack (int): 确认号
         seq (int): 序列号
         data (str): 数据
+        flag (int): 标志位，取值为 DATA、SYN、ACK、FIN 的组合
     """
 
     ack: int
     seq: int
     data: str
+    flag: int = DATA
 
     def to_dict(self):
         """将数据包转换为字典格式"""
         return {
             'ack': self.ack,
             'seq': self.seq,
-            'data': self.data
+            'data': self.data,
+            'flag': self.flag
         }
 
     @staticmethod
     def from_dict(dict: dict):
         """从字典格式恢复数据包"""
-        return Packet(dict['ack'], dict['seq'], dict['data'])
+        return Packet(dict['ack'], dict['seq'], dict['data'], dict.get('flag', DATA))
 
 
 class SRServer:
@@ -52,6 +71,8 @@ class SRServer:
         timer (dict): 计时器字典
         event (Event): 事件对象，用于通知超时
         finished (bool): 传输是否完成的标志
+        client_addr (tuple): 客户端地址，在握手时从 SYN 报文中得到
+        closed (Event): 事件对象，收到 FIN-ACK 时被设置
     """
 
     def __init__(self, addr) -> None:
@@ -67,6 +88,8 @@ class SRServer:
         self.timer = {}
         self.event = Event()
         self.finished = False
+        self.client_addr = None
+        self.closed = Event()
 
     def send_packet(self, packet, client_addr):
         """发送数据包到客户端"""
@@ -76,37 +99,81 @@ class SRServer:
         else:
             print(f"丢失: {packet}")
 
+    def send_control(self, flag, data=''):
+        """发送控制报文（SYN-ACK、FIN），不参与丢包模拟"""
+        packet = Packet(ack=0, seq=self.nextseqnum, data=data, flag=flag)
+        self.sock.sendto(marshal.dumps(packet.to_dict()), self.client_addr)
+
+    def accept(self):
+        """等待客户端的 SYN，记录客户端地址并回复带有窗口大小的 SYN-ACK"""
+        while True:
+            try:
+                buf, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            packet = Packet.from_dict(marshal.loads(buf))
+            if packet.flag & SYN:
+                self.client_addr = addr
+                self.send_control(SYN | ACK, {'window': WINDOW_SIZE, 'fec': FEC})
+                print(f"与客户端 {addr} 建立连接")
+                return
+
+    def close(self):
+        """发送 FIN 并等待 FIN-ACK，超时则重传，重试次数用尽后强制关闭"""
+        for _ in range(HANDSHAKE_RETRY):
+            self.send_control(FIN)
+            print("发送FIN")
+            if self.closed.wait(HANDSHAKE_TIMEOUT):
+                break
+        else:
+            print("未收到FIN-ACK，强制关闭连接")
+        self.finished = True
+        self.closed.set()
+
     def server_start(self):
         """服务器开始传输数据"""
+        self.accept()
         Thread(target=self.receive_ack).start()
-        client_addr = (IP, PORT)
-        while not self.finished:
-            while self.nextseqnum < self.base + WINDOW_SIZE:
-                if self.nextseqnum < 5:  # 总共发送5个数据包
-                    data = f"消息 {self.nextseqnum}"
-                else:
-                    data = "END"
+        client_addr = self.client_addr
+        while True:
+            while self.nextseqnum < min(self.base + WINDOW_SIZE, TOTAL):
+                data = f"消息 {self.nextseqnum}"
                 packet = Packet(ack=0, seq=self.nextseqnum, data=data)
                 self.packets[self.nextseqnum] = packet
-                self.send_packet(packet, client_addr)
+                # 先登记计时器和序号再发送，避免 ACK 先于 nextseqnum 更新到达而被丢弃
                 self.start_timer(self.nextseqnum)
                 self.nextseqnum += 1
-                if data == "END":
-                    self.finished = True
-                    break
+                self.send_packet(packet, client_addr)
+                if FEC is not None and (self.nextseqnum % FEC[0] == 0 or self.nextseqnum == TOTAL):
+                    self.send_parity((self.nextseqnum - 1) // FEC[0])
                 time.sleep(0.5)
             self.event.wait(TIMEOUT)
-            if self.base == self.nextseqnum:
+            if self.base == TOTAL:
                 break
             self.event.clear()
+        self.close()
         print("服务器传输完成，结束连接")
 
+    def send_parity(self, group):
+        """一组数据包发送完毕后发送它的校验包，校验包的 seq 为组号，ack 为组内的校验下标"""
+        k, r = FEC
+        blocks = [self.packets[seq].data.encode() for seq in range(group * k, min((group + 1) * k, TOTAL))]
+        for index, payload in enumerate(fec.encode(blocks, r)):
+            self.send_packet(Packet(ack=index, seq=group, data=payload, flag=PARITY), self.client_addr)
+
     def receive_ack(self):
         """接收客户端的确认"""
         while not self.finished:
             try:
                 buf, _ = self.sock.recvfrom(1024)
                 ack_packet = Packet.from_dict(marshal.loads(buf))
+                if ack_packet.flag == FIN | ACK:
+                    self.closed.set()
+                    break
+                if ack_packet.flag & SYN:
+                    # SYN-ACK 丢失，客户端重传了 SYN
+                    self.send_control(SYN | ACK, {'window': WINDOW_SIZE, 'fec': FEC})
+                    continue
                 print(f"收到ACK: {ack_packet}")
                 if self.base <= ack_packet.ack < self.nextseqnum:
                     self.ack_received[ack_packet.ack] = True
@@ -116,8 +183,8 @@ class SRServer:
                             self.base += 1
                         self.event.set()
             except socket.timeout:
-                for seq in self.timer:
-                    self.send_packet(self.packets[seq], (IP, PORT))
+                for seq in list(self.timer):
+                    self.send_packet(self.packets[seq], self.client_addr)
 
     def start_timer(self, seq):
         """启动计时器"""
@@ -126,9 +193,9 @@ class SRServer:
 
     def check_timeout(self, seq):
         """检查超时并重传"""
-        while seq in self.timer:
+        while seq in self.timer and not self.finished:
             if time.time() - self.timer[seq] > TIMEOUT:
-                self.send_packet(self.packets[seq], (IP, PORT))
+                self.send_packet(self.packets[seq], self.client_addr)
                 self.timer[seq] = time.time()
             time.sleep(0.1)
 
@@ -154,40 +221,111 @@ class SRClient:
         self.expected_seq = 0
         self.received_packets = {}
         self.finished = False
-        Thread(target=self.receive_packet).start()
+        self.fec = None
+        self.groups = {}
 
     def send_ack(self, ack):
         """发送ACK确认"""
-        ack_packet = Packet(ack=ack, seq=0, data='')
+        ack_packet = Packet(ack=ack, seq=0, data='', flag=ACK)
         self.sock.sendto(marshal.dumps(ack_packet.to_dict()), self.server)
         print(f"发送ACK: {ack_packet}")
 
+    def send_control(self, flag):
+        """发送控制报文（SYN、FIN-ACK）"""
+        packet = Packet(ack=0, seq=0, data='', flag=flag)
+        self.sock.sendto(marshal.dumps(packet.to_dict()), self.server)
+
+    def connect(self):
+        """向服务器发送 SYN，收到 SYN-ACK 即连接建立，超时则重传 SYN"""
+        self.sock.settimeout(HANDSHAKE_TIMEOUT)
+        try:
+            for _ in range(HANDSHAKE_RETRY):
+                self.send_control(SYN)
+                try:
+                    buf, _ = self.sock.recvfrom(1024)
+                except socket.timeout:
+                    continue
+                reply = Packet.from_dict(marshal.loads(buf))
+                if reply.flag == SYN | ACK:
+                    self.fec = reply.data.get('fec')
+                    print("与服务器建立连接")
+                    return True
+            return False
+        finally:
+            self.sock.settimeout(TIMEOUT)
+
+    def linger(self):
+        """回复 FIN-ACK 后逗留一段时间，若 FIN-ACK 丢失，服务器重传的 FIN 仍能得到应答"""
+        self.sock.settimeout(LINGER)
+        while True:
+            try:
+                buf, _ = self.sock.recvfrom(1024)
+            except socket.timeout:
+                break
+            if Packet.from_dict(marshal.loads(buf)).flag & FIN:
+                self.send_control(FIN | ACK)
+
     def receive_packet(self):
         """接收服务器发送的数据包"""
+        if not self.connect():
+            print("无法与服务器建立连接")
+            return
         while not self.finished:
             try:
                 buf, _ = self.sock.recvfrom(1024)
                 packet = Packet.from_dict(marshal.loads(buf))
-                print(f"从服务器收到: {packet}")
-                if packet.data == "END":
+                if packet.flag & FIN:
+                    self.send_control(FIN | ACK)
+                    self.linger()
                     self.finished = True
                     print("客户端传输完成，结束连接")
                     break
-                if packet.seq == self.expected_seq:
-                    print(f"按序收到数据包 {packet.seq}")
-                    self.send_ack(packet.seq)
-                    self.expected_seq += 1
-                    while self.expected_seq in self.received_packets:
-                        self.expected_seq += 1
-                elif packet.seq > self.expected_seq:
-                    print(f"缓存乱序数据包 {packet.seq}")
-                    self.received_packets[packet.seq] = packet
-                    self.send_ack(packet.seq)
-                else:
-                    self.send_ack(self.expected_seq - 1)
+                if packet.flag & SYN:
+                    continue
+                if packet.flag & PARITY:
+                    if self.fec is not None:
+                        self.group(packet.seq).add_parity(packet.ack, packet.data)
+                        self.recover(packet.seq)
+                    continue
+                print(f"从服务器收到: {packet}")
+                self.handle_packet(packet)
+                if self.fec is not None:
+                    k = self.fec[0]
+                    self.group(packet.seq // k).add_data(packet.seq % k, packet.data.encode())
+                    self.recover(packet.seq // k)
             except socket.timeout:
                 continue
 
+    def group(self, index):
+        """取得组号对应的 FEC 缓存，不存在时新建"""
+        if index not in self.groups:
+            self.groups[index] = fec.FecGroup(self.fec[1])
+        return self.groups[index]
+
+    def recover(self, group):
+        """用校验包恢复组内丢失的数据包，恢复出的数据包与收到的数据包一样被缓存和确认，发送方不必再重传"""
+        k = self.fec[0]
+        for i in self.groups[group].recover():
+            packet = Packet(ack=0, seq=group * k + i, data=self.groups[group].blocks[i].decode())
+            print(f"通过FEC恢复: {packet}")
+            self.handle_packet(packet)
+
+    def handle_packet(self, packet):
+        """按序到达的数据包推进期待的序号，乱序的数据包先缓存，两者都需要单独确认"""
+        if packet.seq == self.expected_seq:
+            print(f"按序收到数据包 {packet.seq}")
+            self.send_ack(packet.seq)
+            self.expected_seq += 1
+            while self.expected_seq in self.received_packets:
+                self.expected_seq += 1
+        elif packet.seq > self.expected_seq:
+            print(f"缓存乱序数据包 {packet.seq}")
+            self.received_packets[packet.seq] = packet
+            self.send_ack(packet.seq)
+        else:
+            # 重复的数据包说明之前的 ACK 丢失，需要针对它再次确认
+            self.send_ack(packet.seq)
+
 
 def main():
     """程序入口函数"""
@@ -205,4 +343,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
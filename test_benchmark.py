@@ -0,0 +1,19 @@
+"""
+    性能回归测试的 pytest 入口，每个场景是一个测试用例，指标的定义和基线的更新方法见 benchmark.py。
+    计时的结果会受到机器上其他任务的影响，普通的测试运行不应因此失败，
+    因此只有设置了环境变量 GBN_BENCHMARK=1 时才运行，例如 GBN_BENCHMARK=1 python -m pytest test_benchmark.py
+"""
+import os
+
+import pytest
+
+import benchmark
+
+pytestmark = pytest.mark.skipif(os.environ.get('GBN_BENCHMARK') != '1',
+                                reason='性能回归测试需要设置环境变量 GBN_BENCHMARK=1')
+
+
+@pytest.mark.parametrize('scenario', list(benchmark.SCENARIOS))
+def test_scenario(scenario):
+    regressions = benchmark.compare(scenario, benchmark.measure(scenario), benchmark.load_baseline())
+    assert not regressions, '\n'.join(regressions)
@@ -0,0 +1,109 @@
+"""
+    命令行模式的接收方在异常输入下的行为：端口上收到无法解析的报文时丢弃它，接收方的线程异常退出时不会一直挂起，
+    输出到目录时不同的源文件不会因为同名而互相覆盖
+"""
+import argparse
+import marshal
+import os
+import socket
+import time
+from threading import Event, Thread
+
+import pytest
+
+import gbn_main
+
+
+@pytest.mark.parametrize('buf', [
+    b'hello',
+    b'',
+    marshal.dumps(5),
+    marshal.dumps({'seq': 1}),
+    marshal.dumps({'ack': 'x', 'seq': 0, 'data': b''}),
+])
+def test_decode_rejects_malformed_datagram(buf):
+    with pytest.raises(gbn_main.MALFORMED):
+        gbn_main.packet.decode(buf)
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((gbn_main.IP, 0))
+        return sock.getsockname()[1]
+
+
+def test_receiver_survives_stray_datagram(tmp_path, monkeypatch):
+    monkeypatch.setattr(gbn_main, 'LOST_POSSIBILITY', 0.0)
+    monkeypatch.setattr(gbn_main, 'VERBOSE', False)
+    src = tmp_path / 'a.bin'
+    src.write_bytes(os.urandom(20000))
+    out = str(tmp_path / 'b.bin')
+    addr = (gbn_main.IP, free_port())
+    event = Event()
+    waiter = gbn_main.stripe_receive(out, 1, event, addr)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(b'hello', addr)
+    clients = gbn_main.stripe_send(str(src), 1, addr)
+    if not clients[0].completed:
+        event.set()
+    waiter.join()
+    assert clients[0].completed
+    with open(out, 'rb') as file:
+        assert file.read() == src.read_bytes()
+
+
+def test_run_recv_fails_when_server_thread_dies(tmp_path, monkeypatch):
+    monkeypatch.setattr(gbn_main, 'VERBOSE', False)
+
+    def crash(self, syn, addr):
+        raise RuntimeError('模拟接收方的故障')
+
+    monkeypatch.setattr(gbn_main.server, 'accept', crash)
+    # 线程中未捕获的异常只会打印出来，这里不需要它
+    monkeypatch.setattr('threading.excepthook', lambda args: None)
+    port = free_port()
+    args = argparse.Namespace(host=gbn_main.IP, port=port, streams=1, output=str(tmp_path / 'b.bin'),
+                              count=None, json=True)
+    result = []
+    runner = Thread(target=lambda: result.append(gbn_main.run_recv(args)))
+    runner.start()
+    time.sleep(0.2)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(gbn_main.packet(0, 0, {}, gbn_main.SYN).encode(), (gbn_main.IP, port))
+    runner.join(5)
+    assert not runner.is_alive()
+    assert result == [gbn_main.EXIT_FAILED]
+
+
+def test_storage_rejects_other_source_with_same_name(tmp_path):
+    output = gbn_main.storage(str(tmp_path))
+    first = output.acquire('a/x.bin', '10:1')
+    # 同一个源文件再次传输（例如续传）使用同一个组装器
+    assert output.acquire('x.bin', '10:1') is first
+    with pytest.raises(FileExistsError):
+        output.acquire('b/x.bin', '10:2')
+    assert output.rejected == {(str(tmp_path / 'x.bin'), '10:2')}
+    assert output.acquire('y.bin', '10:2') is not first
+
+
+def test_run_recv_rejects_second_file_with_same_name(tmp_path, monkeypatch):
+    monkeypatch.setattr(gbn_main, 'LOST_POSSIBILITY', 0.0)
+    monkeypatch.setattr(gbn_main, 'VERBOSE', False)
+    out = tmp_path / 'out'
+    out.mkdir()
+    sources = []
+    for sub in ('a', 'b'):
+        (tmp_path / sub).mkdir()
+        sources.append(tmp_path / sub / 'x.bin')
+        sources[-1].write_bytes(os.urandom(5000))
+    port = free_port()
+    args = argparse.Namespace(host=gbn_main.IP, port=port, streams=1, output=str(out), count=2, json=True)
+    result = []
+    runner = Thread(target=lambda: result.append(gbn_main.run_recv(args)))
+    runner.start()
+    time.sleep(0.2)
+    sent = [gbn_main.stripe_send(str(src), 1, (gbn_main.IP, port))[0].completed for src in sources]
+    runner.join(5)
+    assert sent == [True, False]
+    assert result == [gbn_main.EXIT_FAILED]
+    assert (out / 'x.bin').read_bytes() == sources[0].read_bytes()
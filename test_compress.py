@@ -0,0 +1,118 @@
+"""
+    压缩阶段的测试：解压时拒绝超过上限或不完整的数据段，打包的数据段能够还原并且不超过 mss，
+    数据难以压缩时跳过压缩；以及接收方丢弃无法解压的数据包
+"""
+import random
+import zlib
+from threading import Event
+
+import pytest
+
+import compress
+import gbn_main
+
+
+def text(size: int) -> bytes:
+    rand = random.Random(1)
+    words = [bytes(rand.choice(b'abcdefghij') for _ in range(rand.randint(2, 8))) for _ in range(200)]
+    data = b' '.join(rand.choice(words) for _ in range(size // 4))
+    return data[:size]
+
+
+def test_zlib_decompress_rejects_bomb_over_limit():
+    bomb = zlib.compress(bytes(1 << 20), 9)
+    assert len(bomb) < 2000
+    with pytest.raises(ValueError):
+        compress.zlib_decompress(bomb, 64000)
+    assert compress.zlib_decompress(bomb, 1 << 20) == bytes(1 << 20)
+
+
+def test_zlib_decompress_rejects_truncated_stream():
+    payload = zlib.compress(text(5000))
+    with pytest.raises(ValueError):
+        compress.zlib_decompress(payload[:len(payload) // 2], 1 << 20)
+    with pytest.raises(ValueError):
+        compress.zlib_decompress(payload[:-1], 1 << 20)
+
+
+def test_decompress_limit_follows_mss_and_wraps_corrupt_data():
+    data = bytes(500 * compress.MAX_RATIO + 1)
+    with pytest.raises(ValueError):
+        compress.decompress(zlib.compress(data), 500)
+    assert compress.decompress(zlib.compress(data[:-1]), 500) == data[:-1]
+    with pytest.raises(ValueError):
+        compress.decompress(b'not a zlib stream', 500)
+
+
+def pack(data: bytes, mss: int) -> list:
+    return list(compress.Compressor(mss).pack(lambda off, size: data[off:off + size], 0, len(data)))
+
+
+@pytest.mark.parametrize('mss', [500, 1400, 65000])
+def test_pack_round_trip(mss):
+    data = text(300000)
+    segments = pack(data, mss)
+    off = 0
+    restored = b''
+    for seg_off, size, payload in segments:
+        assert seg_off == off
+        off += size
+        if payload is None:
+            assert size <= mss
+            restored += data[seg_off:seg_off + size]
+        else:
+            assert len(payload) <= mss
+            restored += compress.decompress(payload, mss)
+    assert restored == data
+    # 文本数据可以压缩，数据段应当明显少于不压缩时的个数
+    assert len(segments) < len(data) / mss / 2
+
+
+def test_pack_bypasses_random_data():
+    data = random.Random(2).randbytes(200000)
+    segments = pack(data, 500)
+    assert all(payload is None for _, _, payload in segments)
+    assert b''.join(data[off:off + size] for off, size, _ in segments) == data
+    assert all(size <= 500 for _, size, _ in segments)
+
+
+def test_pack_reads_only_what_it_needs():
+    data = text(1 << 20)
+    read = [0]
+
+    def counted(off, size):
+        read[0] += size
+        return data[off:off + size]
+
+    list(compress.Compressor(65000).pack(counted, 0, len(data)))
+    assert read[0] < 2 * len(data)
+
+
+@pytest.fixture
+def receiver():
+    server_ins = gbn_main.server((gbn_main.IP, 0), Event())
+    server_ins.mss = 500
+    yield server_ins
+    server_ins.sock.close()
+
+
+def test_deliver_drops_compressed_packet_without_codec(receiver, monkeypatch):
+    monkeypatch.setattr(gbn_main, 'VERBOSE', False)
+    payload = zlib.compress(b'hello')
+    assert not receiver.deliver(gbn_main.packet(0, 0, payload, gbn_main.COMPRESSED))
+    assert receiver.seq == 0 and receiver.received == 0
+    receiver.codec = 'zlib'
+    assert receiver.deliver(gbn_main.packet(0, 0, payload, gbn_main.COMPRESSED))
+    assert receiver.seq == 1 and receiver.received == 5
+
+
+@pytest.mark.parametrize('payload', [
+    b'not a zlib stream',
+    zlib.compress(bytes(500 * compress.MAX_RATIO + 1)),
+    zlib.compress(b'hello' * 100)[:-4],
+])
+def test_deliver_drops_undecompressible_packet(receiver, monkeypatch, payload):
+    monkeypatch.setattr(gbn_main, 'VERBOSE', False)
+    receiver.codec = 'zlib'
+    assert not receiver.deliver(gbn_main.packet(0, 0, payload, gbn_main.COMPRESSED))
+    assert receiver.seq == 0 and receiver.received == 0
@@ -0,0 +1,88 @@
+"""
+    前向纠错的测试：校验包能够恢复组内丢失的数据块，恢复结果按 lens 去掉补齐的零字节，
+    r > 1 时第 j 个校验包只覆盖下标 i % r == j 的数据块
+"""
+import os
+
+import pytest
+
+import fec
+
+
+def transmit(blocks: list, r: int, lost: set, flags: list = None) -> fec.FecGroup:
+    """
+        模拟一组数据块和它们的校验包经过信道：lost 中的数据块丢失，校验包全部到达，返回接收方的缓存
+    """
+    group = fec.FecGroup(r)
+    for index, block in enumerate(blocks):
+        if index not in lost:
+            group.add_data(index, block, flags[index] if flags else 0)
+    for index, payload in enumerate(fec.encode(blocks, r, flags=flags)):
+        group.add_parity(index, payload)
+    return group
+
+
+@pytest.mark.parametrize('lost', [0, 1, 3])
+def test_r1_recovers_any_single_loss(lost):
+    blocks = [os.urandom(500) for _ in range(4)]
+    group = transmit(blocks, 1, {lost})
+    assert group.recover() == [lost]
+    assert group.blocks[lost] == blocks[lost]
+
+
+def test_r1_cannot_recover_two_losses():
+    blocks = [os.urandom(500) for _ in range(4)]
+    group = transmit(blocks, 1, {0, 2})
+    assert group.recover() == []
+    assert 0 not in group.blocks and 2 not in group.blocks
+
+
+def test_r2_recovers_one_loss_per_residue():
+    blocks = [os.urandom(300) for _ in range(6)]
+    # 下标 1 和 4 分别属于第 1 个和第 0 个校验包
+    group = transmit(blocks, 2, {1, 4})
+    assert group.recover() == [1, 4]
+    assert group.blocks[1] == blocks[1] and group.blocks[4] == blocks[4]
+
+
+def test_r2_cannot_recover_two_losses_in_same_residue():
+    blocks = [os.urandom(300) for _ in range(6)]
+    group = transmit(blocks, 2, {0, 2, 3})
+    # 下标 0 和 2 都属于第 0 个校验包，只有下标 3 能够恢复
+    assert group.recover() == [3]
+    assert group.blocks[3] == blocks[3]
+    assert 0 not in group.blocks and 2 not in group.blocks
+
+
+@pytest.mark.parametrize('r', [1, 2])
+def test_uneven_last_group_is_trimmed_to_original_lengths(r):
+    # 文件的最后一组数据块少于 k 个，最后一个数据块也比其他的短
+    blocks = [os.urandom(500), os.urandom(500), os.urandom(37)]
+    for lost in range(len(blocks)):
+        group = transmit(blocks, r, {lost})
+        assert group.recover() == [lost]
+        assert group.blocks[lost] == blocks[lost]
+
+
+@pytest.mark.parametrize('r', [1, 2])
+def test_blocks_with_trailing_zero_bytes(r):
+    blocks = [b'abc' + bytes(10), os.urandom(20), bytes(16), b'x' + bytes(3), b'']
+    for lost in range(len(blocks)):
+        group = transmit(blocks, r, {lost})
+        assert group.recover() == [lost]
+        assert group.blocks[lost] == blocks[lost]
+
+
+def test_recovered_block_keeps_its_flag():
+    blocks = [os.urandom(100) for _ in range(4)]
+    flags = [0, 32, 0, 32]
+    group = transmit(blocks, 1, {1}, flags)
+    group.recover()
+    assert group.flags[1] == 32
+
+
+def test_recover_without_parity_does_nothing():
+    group = fec.FecGroup(1)
+    group.add_data(0, b'abc')
+    assert group.recover() == []
+    assert group.blocks == {0: b'abc'}
@@ -0,0 +1,112 @@
+"""
+    接收方进度日志和组装器的测试：区间的合并与缺口的计算，以及续传时是否正确地判断磁盘上的日志属于同一个文件
+"""
+import os
+
+import gbn_main
+
+
+def test_add_merges_overlapping_and_adjacent_ranges():
+    j = gbn_main.journal('unused')
+    j.reset(100)
+    j.add(10, 20)
+    j.add(30, 40)
+    j.add(20, 25)
+    j.add(35, 50)
+    assert j.ranges == [[10, 25], [30, 50]]
+    j.add(0, 100)
+    assert j.ranges == [[0, 100]]
+
+
+def test_missing_returns_holes_within_range():
+    j = gbn_main.journal('unused')
+    j.reset(100)
+    j.add(10, 20)
+    j.add(30, 40)
+    assert j.missing(0, 100) == [(0, 10), (20, 30), (40, 100)]
+    assert j.missing(15, 35) == [(20, 30)]
+    assert j.missing(10, 20) == []
+    assert j.missing(45, 60) == [(45, 60)]
+
+
+def test_complete():
+    j = gbn_main.journal('unused')
+    assert not j.complete()
+    j.reset(50)
+    j.add(0, 30)
+    assert not j.complete()
+    j.add(30, 50)
+    assert j.complete()
+    j.reset(0)
+    assert j.complete()
+
+
+def test_load_requires_same_size_and_source(tmp_path):
+    path = str(tmp_path / 'o.bin.journal')
+    j = gbn_main.journal(path)
+    j.reset(100, '100:1')
+    j.add(0, 40)
+    j.save()
+    assert gbn_main.journal(path).load(100, '100:1')
+    assert not gbn_main.journal(path).load(200, '100:1')
+    assert not gbn_main.journal(path).load(100, '100:2')
+    assert not gbn_main.journal(path).load(100)
+    loaded = gbn_main.journal(path)
+    loaded.load(100, '100:1')
+    assert loaded.missing(0, 100) == [(40, 100)]
+
+
+def test_load_rejects_missing_or_corrupt_journal(tmp_path):
+    path = tmp_path / 'o.bin.journal'
+    assert not gbn_main.journal(str(path)).load(100)
+    path.write_text('{not json')
+    assert not gbn_main.journal(str(path)).load(100)
+
+
+def interrupted(path: str, data: bytes, source: str, upto: int):
+    """
+        模拟一次中断的传输：只写入了 data 的前 upto 字节
+    """
+    output = gbn_main.assembler(path)
+    output.allocate(len(data), source)
+    output.write(0, data[:upto])
+    output.flush()
+    output.file.close()
+    output.file = None
+
+
+def test_allocate_resumes_same_source(tmp_path):
+    path = str(tmp_path / 'o.bin')
+    old = os.urandom(1000)
+    interrupted(path, old, '1000:1', 600)
+    output = gbn_main.assembler(path)
+    output.allocate(1000, '1000:1')
+    assert output.missing(0, 1000) == [(600, 1000)]
+    output.close()
+    with open(path, 'rb') as file:
+        assert file.read(600) == old[:600]
+
+
+def test_allocate_restarts_for_different_source_of_same_size(tmp_path):
+    path = str(tmp_path / 'o.bin')
+    interrupted(path, os.urandom(1000), '1000:1', 600)
+    output = gbn_main.assembler(path)
+    output.allocate(1000, '1000:2')
+    assert output.missing(0, 1000) == [(0, 1000)]
+    new = os.urandom(1000)
+    output.write(0, new)
+    output.close()
+    with open(path, 'rb') as file:
+        assert file.read() == new
+    assert not os.path.exists(path + '.journal')
+
+
+def test_allocate_restarts_when_output_size_differs(tmp_path):
+    path = str(tmp_path / 'o.bin')
+    interrupted(path, os.urandom(1000), '1000:1', 600)
+    with open(path, 'ab') as file:
+        file.write(b'x')
+    output = gbn_main.assembler(path)
+    output.allocate(1000, '1000:1')
+    assert output.missing(0, 1000) == [(0, 1000)]
+    output.close()
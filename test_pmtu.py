@@ -0,0 +1,42 @@
+"""
+    路径 MTU 查找的测试：结果是否准确，以及失败的探测（每次都要等到超时）是否足够少
+"""
+import pytest
+
+import pmtu
+
+
+def probe(limit: int, calls: list):
+    def attempt(size: int) -> bool:
+        calls.append(size)
+        return size <= limit
+    return attempt
+
+
+@pytest.mark.parametrize('limit', [pmtu.MIN_DATAGRAM, 1000, 1372, 1500 - pmtu.UDP_OVERHEAD,
+                                   9000 - pmtu.UDP_OVERHEAD, 12000, pmtu.MAX_DATAGRAM])
+def test_search_finds_limit_within_granule(limit):
+    calls = []
+    size = pmtu.search(probe(limit, calls), pmtu.MIN_DATAGRAM, pmtu.MAX_DATAGRAM)
+    assert limit - pmtu.GRANULE <= size <= limit
+    assert sum(call > limit for call in calls) <= 6
+
+
+@pytest.mark.parametrize('mtu', [1500, 9000])
+def test_search_on_plateau_needs_two_failed_probes(mtu):
+    calls = []
+    limit = mtu - pmtu.UDP_OVERHEAD
+    assert pmtu.search(probe(limit, calls), pmtu.MIN_DATAGRAM, pmtu.MAX_DATAGRAM) == limit
+    assert sum(call > limit for call in calls) == 2
+
+
+def test_search_returns_none_when_low_fails():
+    assert pmtu.search(lambda size: False, pmtu.MIN_DATAGRAM, pmtu.MAX_DATAGRAM) is None
+    assert pmtu.search(lambda size: True, 1000, 1000) == 1000
+
+
+def test_next_plateau_is_bounded_by_high():
+    assert pmtu.next_plateau(pmtu.MIN_DATAGRAM, pmtu.MAX_DATAGRAM) == 1006 - pmtu.UDP_OVERHEAD
+    assert pmtu.next_plateau(1472, pmtu.MAX_DATAGRAM) == 2002 - pmtu.UDP_OVERHEAD
+    assert pmtu.next_plateau(1472, 1800) == 1800
+    assert pmtu.next_plateau(pmtu.MAX_DATAGRAM, pmtu.MAX_DATAGRAM) == pmtu.MAX_DATAGRAM